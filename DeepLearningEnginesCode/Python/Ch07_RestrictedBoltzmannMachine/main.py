@@ -4,15 +4,19 @@
 RBM network.
 @author: Gabriel Bianconi, modified by JimStone
 # This takes about 10 minutes to run on a 2015 mac. 
-# Description: Applies a single 2-layer RBM to the MNIST dataset of images of digits from 0-9. The trained model uses a SciPy-based logistic regression to classify outputs. It achieves 92.8% classification accuracy on the test set of images.
-Result: 9237/10000
+# Description: Applies a single 2-layer RBM to the MNIST dataset of images of digits from 0-9. The trained model's hidden unit features are streamed to disk and classified by a logistic regression trained incrementally with stochastic gradient descent; the script prints its accuracy on the test set of images.
 """
+import math
+import os
+import sys
+from statistics import NormalDist
 import numpy as np
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import SGDClassifier
 import torch
-import torchvision.datasets
-import torchvision.models
-import torchvision.transforms
+
+# mnist_tensors.py is shared with Ch08 and Ch09 and lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mnist_tensors import TensorMNIST, BatchLoader
 
 ########## CONFIGURATION ##########
 
@@ -26,8 +30,30 @@ CD_K = 2 # number of contrastive divergence (CD) steps per training vector
 
 EPOCHS = 2 # number of times the entire data set is used to train RBM
 
+PERSISTENT = False # True = persistent contrastive divergence (PCD): negative chains carry over between batches
+
+FANTASY_PARTICLES = 100 # number of persistent negative chains (fantasy particles) used by PCD
+
+TEMPERATURES = 1 # number of PCD chain sets at different temperatures; >1 adds parallel tempering
+
 DATA_FOLDER = 'data/mnist'
 
+CHECKPOINT_FILE = 'data/rbm_checkpoint.pt' # training state is saved here and resumed from if it exists
+
+CHECKPOINT_EVERY = 100 # save a checkpoint every this many batches (0 = only at the end of each epoch)
+
+FEATURE_FOLDER = 'data/features' # hidden unit features are streamed to memory-mapped float32 files here
+
+CLASSIFIER_EPOCHS = 5 # number of passes of the incremental classifier over the feature files
+
+CLASSIFIER_CHUNK = 10000 # number of feature rows read from disk per partial_fit() call
+
+DBN_HIDDEN_UNITS = [] # hidden layer sizes of an optional deep belief network (DBN) trained after the RBM, e.g. [500, 128]
+
+AIS_CHAINS = 100 # number of parallel annealing runs used to estimate the partition function
+
+AIS_BETAS = 10000 # number of intermediate temperatures between the base-rate model and the RBM
+
 # CUDA = Compute Unified Device Architecture, a GPU processor.
 # Don't worry if you don't have this, the code can work without it.
 CUDA = torch.cuda.is_available()
@@ -40,7 +66,8 @@ if CUDA:
 
 class RBM():
 
-    def __init__(self, num_visible, num_hidden, k, learning_rate=1e-3, momentum_coefficient=0.5,weight_decay=1e-4, use_cuda=True):
+    def __init__(self, num_visible, num_hidden, k, learning_rate=1e-3, momentum_coefficient=0.5,weight_decay=1e-4, use_cuda=True,
+                 persistent=False, num_particles=100, num_temperatures=1):
         
         self.num_visible    = num_visible
         self.num_hidden     = num_hidden
@@ -71,58 +98,163 @@ class RBM():
             self.visible_bias_momentum  = self.visible_bias_momentum.cuda()
             self.hidden_bias_momentum   = self.hidden_bias_momentum.cuda()
 
-    def sample_hidden(self, visible_probabilities):
-        # get input to each hidden unit
-        hidden_activations = torch.matmul(visible_probabilities, self.weights) + self.hidden_bias
-        # use hidden unit inputs to find prob(on)=hidden_probabilities
-        hidden_probabilities = self._sigmoid(hidden_activations)
+        # persistent contrastive divergence (PCD): binary hidden states of the fantasy particles,
+        # one set of num_particles chains per temperature, kept on the same device as the weights.
+        # Chain set 0 samples the RBM itself (inverse temperature beta = 1); with parallel tempering
+        # the other sets sample flatter versions (beta < 1) and swap states with their neighbours.
+        self.persistent     = persistent
+        self.num_particles  = num_particles
+        self.betas          = torch.linspace(1, 0, num_temperatures + 1, device=self.weights.device)[:-1].view(-1, 1, 1)
+        self.fantasy_hidden = torch.bernoulli(torch.full((num_temperatures, num_particles, num_hidden), 0.5, device=self.weights.device))
+        self.swap_offset    = 0
+
+        # work tensors for contrastive_divergence(), allocated once per batch size and reused by every Gibbs step
+        self.buffer_size    = None
+
+    def sample_hidden(self, visible_probabilities, out=None):
+        # get input to each hidden unit (written into out, if given)
+        hidden_activations = torch.matmul(visible_probabilities, self.weights, out=out)
+        # use hidden unit inputs to find prob(on)=hidden_probabilities, in place
+        hidden_probabilities = hidden_activations.add_(self.hidden_bias).sigmoid_()
         return hidden_probabilities
 
-    def sample_visible(self, hidden_probabilities):
-        # get input to each visible unit
-        visible_activations = torch.matmul(hidden_probabilities, self.weights.t()) + self.visible_bias
-        # use visible unit inputs to find prob(on)=hidden_probabilities
-        visible_probabilities = self._sigmoid(visible_activations)
+    def sample_visible(self, hidden_probabilities, out=None):
+        # get input to each visible unit (written into out, if given)
+        visible_activations = torch.matmul(hidden_probabilities, self.weights.t(), out=out)
+        # use visible unit inputs to find prob(on)=visible_probabilities, in place
+        visible_probabilities = visible_activations.add_(self.visible_bias).sigmoid_()
         return visible_probabilities
 
-    def _sigmoid(self, x):
-        return 1 / (1 + torch.exp(-x))
-
-    def _random_probabilities(self, num):
-        random_probabilities = torch.rand(num)
+    def _sample(self, probabilities, out):
+        # binary states with prob(on) = probabilities, drawn independently for every
+        # sample and unit, written in place into out
+        return out.bernoulli_(probabilities)
+
+    def _allocate_buffers(self, batch_size):
+        # (re)allocate the contrastive divergence work tensors when the batch size changes
+        if self.buffer_size == batch_size:
+            return
+        device = self.weights.device
+        self.positive_hidden_buffer     = torch.empty(batch_size, self.num_hidden, device=device)
+        self.hidden_activations_buffer  = torch.empty(batch_size, self.num_hidden, device=device)
+        self.visible_buffer             = torch.empty(batch_size, self.num_visible, device=device)
+        self.negative_hidden_buffer     = torch.empty(batch_size, self.num_hidden, device=device)
+        self.buffer_size = batch_size
+
+    def free_energy(self, visible):
+        # F(v) = -b.v - sum_j log(1 + exp(c_j + v.W_j)), so that p(v) = exp(-F(v)) / Z
+        # softplus computes log(1 + exp(x)) without overflow
+        hidden_activations = torch.matmul(visible, self.weights) + self.hidden_bias
+        return -torch.matmul(visible, self.visible_bias) - torch.nn.functional.softplus(hidden_activations).sum(dim=1)
+
+    def _log_prob_hidden(self, hidden, betas):
+        # unnormalised log p(h) at inverse temperature beta, with the visible units summed out:
+        # beta c.h + sum_i log(1 + exp(beta (b_i + W_i.h)))
+        visible_activations = torch.matmul(hidden, self.weights.t()) + self.visible_bias
+        return betas.view(-1, 1) * torch.matmul(hidden, self.hidden_bias) \
+            + torch.nn.functional.softplus(betas * visible_activations).sum(dim=-1)
+
+    def _swap_temperatures(self, hidden):
+        # parallel tempering: propose to swap each particle between neighbouring temperatures
+        # (alternating even and odd pairs on successive calls), accepted with the Metropolis probability
+        num_temperatures = hidden.size(0)
+        lower = torch.arange(self.swap_offset, num_temperatures - 1, 2, device=hidden.device)
+        self.swap_offset = 1 - self.swap_offset
+        if len(lower) == 0:
+            return hidden
+        upper = lower + 1
+        beta_lower, beta_upper = self.betas[lower], self.betas[upper]
+        log_ratio = self._log_prob_hidden(hidden[upper], beta_lower) + self._log_prob_hidden(hidden[lower], beta_upper) \
+            - self._log_prob_hidden(hidden[lower], beta_lower) - self._log_prob_hidden(hidden[upper], beta_upper)
+        accept = (torch.log(torch.rand_like(log_ratio)) < log_ratio).unsqueeze(-1)
+        swapped = hidden.clone()
+        swapped[lower] = torch.where(accept, hidden[upper], hidden[lower])
+        swapped[upper] = torch.where(accept, hidden[lower], hidden[upper])
+        return swapped
+
+    def _persistent_negative_phase(self):
+        # run k Gibbs steps on every fantasy particle, at each chain set's temperature
+        hidden_activations = self.fantasy_hidden
+        for step in range(self.k):
+            visible_probabilities   = torch.matmul(hidden_activations, self.weights.t()).add_(self.visible_bias).mul_(self.betas).sigmoid_()
+            visible_activations     = torch.bernoulli(visible_probabilities)
+            hidden_probabilities    = torch.matmul(visible_activations, self.weights).add_(self.hidden_bias).mul_(self.betas).sigmoid_()
+            hidden_activations      = torch.bernoulli(hidden_probabilities)
+
+        if len(self.betas) > 1:
+            hidden_activations = self._swap_temperatures(hidden_activations)
+        self.fantasy_hidden = hidden_activations
+
+        # the negative statistics come from the beta = 1 chains only
+        return visible_probabilities[0], hidden_probabilities[0]
+
+    def state_dict(self):
+        # everything needed to continue training exactly where it stopped
+        return {'weights': self.weights, 'visible_bias': self.visible_bias, 'hidden_bias': self.hidden_bias,
+                'weights_momentum': self.weights_momentum, 'visible_bias_momentum': self.visible_bias_momentum,
+                'hidden_bias_momentum': self.hidden_bias_momentum,
+                'fantasy_hidden': self.fantasy_hidden, 'swap_offset': self.swap_offset}
+
+    def load_state_dict(self, state):
+        device = self.weights.device
+        names = ['weights', 'visible_bias', 'hidden_bias', 'weights_momentum', 'visible_bias_momentum',
+                 'hidden_bias_momentum', 'fantasy_hidden']
+        for name in names: # check every shape before changing anything
+            if state[name].shape != getattr(self, name).shape:
+                raise ValueError('%s has shape %s in the saved state but %s in this RBM'
+                                 % (name, tuple(state[name].shape), tuple(getattr(self, name).shape)))
+        for name in names:
+            setattr(self, name, state[name].to(device))
+        self.swap_offset = state['swap_offset']
+
+    def hyperparameters(self):
+        # the settings a saved state only makes sense with
+        return {'num_visible': self.num_visible, 'num_hidden': self.num_hidden, 'k': self.k,
+                'persistent': self.persistent, 'num_particles': self.num_particles,
+                'num_temperatures': len(self.betas)}
 
-        if self.use_cuda:
-            random_probabilities = random_probabilities.cuda()
-        return random_probabilities
-    
 # ===========================================================
     def contrastive_divergence(self, input_data):
         # input_data is 64 (batch size) by 784 (real valued pixels in input image)
         # =Positive phase==================================================
         # Positive phase = use 'clamped' visible unit states to sample hidden unit states.
         # sample_hidden() treats each real-valued pixel as a probability
-        positive_hidden_probabilities   = self.sample_hidden(input_data) # 64 x 128 hidden units
-        # use positive_hidden_probabilities to get sample of binary hidden unit states
-        positive_hidden_activations = (positive_hidden_probabilities >= self._random_probabilities(self.num_hidden)).float() # BATCH_SIZE = 64 x 128 hidden units
+        batch_size = input_data.size(0)
+        self._allocate_buffers(batch_size)
+
+        positive_hidden_probabilities   = self.sample_hidden(input_data, out=self.positive_hidden_buffer) # 64 x 128 hidden units
+        # use positive_hidden_probabilities to get sample of binary hidden unit states,
+        # with independent noise for every image and hidden unit
+        positive_hidden_activations = self._sample(positive_hidden_probabilities, self.hidden_activations_buffer) # BATCH_SIZE = 64 x 128 hidden units
         
         positive_associations = torch.matmul(input_data.t(), positive_hidden_activations)
         # print((positive_associations.shape)) # torch.Size([784, 128]) HIDDEN_UNITS = 128
         # .t() = transpose: https://pytorch.org/docs/0.3.1/torch.html#torch.t
         # positive_associations measures correlation between visible and hidden unit states when visible units are  clamped to training data.
-        
-        # =Negative phase==================================================
-        # Negative phase, initialise with final binary positive_hidden_activations
-        hidden_activations = positive_hidden_activations # 64 x 128
 
-        for step in range(self.k): # number of contrastive divergence steps
-            visible_probabilities   = self.sample_visible(hidden_activations)
-            hidden_probabilities    = self.sample_hidden(visible_probabilities)
-            hidden_activations      = (hidden_probabilities >= self._random_probabilities(self.num_hidden)).float()
-
-        negative_visible_probabilities  = visible_probabilities
-        negative_hidden_probabilities   = hidden_probabilities
+        # =Negative phase==================================================
+        if self.persistent:
+            # PCD: continue the persistent fantasy particles instead of restarting from the data
+            negative_visible_probabilities, negative_hidden_probabilities = self._persistent_negative_phase()
+            # rescale sums over num_particles chains to match sums over the batch
+            negative_scale = batch_size / self.num_particles
+            reconstruction = self.sample_visible(positive_hidden_activations)
+        else:
+            # Negative phase, initialise with final binary positive_hidden_activations
+            # (each step overwrites the same preallocated tensors)
+            hidden_activations = positive_hidden_activations # 64 x 128
+
+            for step in range(self.k): # number of contrastive divergence steps
+                visible_probabilities   = self.sample_visible(hidden_activations, out=self.visible_buffer)
+                hidden_probabilities    = self.sample_hidden(visible_probabilities, out=self.negative_hidden_buffer)
+                hidden_activations      = self._sample(hidden_probabilities, self.hidden_activations_buffer)
+
+            negative_visible_probabilities  = visible_probabilities
+            negative_hidden_probabilities   = hidden_probabilities
+            negative_scale = 1.0
+            reconstruction = negative_visible_probabilities
         # negative_associations measures correlation between visible and hidden unit states when visible units are not clamped to training data.
-        negative_associations = torch.matmul(negative_visible_probabilities.t(), negative_hidden_probabilities)
+        negative_associations = torch.matmul(negative_visible_probabilities.t(), negative_hidden_probabilities) * negative_scale
 
         # Update weight change
         self.weights_momentum *= self.momentum_coefficient
@@ -130,13 +262,11 @@ class RBM():
 
         # Update visible bias terms
         self.visible_bias_momentum *= self.momentum_coefficient
-        self.visible_bias_momentum += torch.sum(input_data - negative_visible_probabilities, dim=0)
+        self.visible_bias_momentum += torch.sum(input_data, dim=0) - torch.sum(negative_visible_probabilities, dim=0) * negative_scale
 
         # Update hidden bias terms
         self.hidden_bias_momentum *= self.momentum_coefficient
-        self.hidden_bias_momentum += torch.sum(positive_hidden_probabilities - negative_hidden_probabilities, dim=0)
-
-        batch_size = input_data.size(0)
+        self.hidden_bias_momentum += torch.sum(positive_hidden_probabilities, dim=0) - torch.sum(negative_hidden_probabilities, dim=0) * negative_scale
 
         self.weights        += self.weights_momentum * self.learning_rate / batch_size
         self.visible_bias   += self.visible_bias_momentum * self.learning_rate / batch_size
@@ -145,35 +275,218 @@ class RBM():
         self.weights -= self.weights * self.weight_decay  # L2 weight decay
 
         # Compute reconstruction error
-        error = torch.sum((input_data - negative_visible_probabilities)**2)
+        error = torch.sum((input_data - reconstruction)**2)
 
         return error
 # ===========================================================
 
 
+def annealed_importance_sampling(rbm, num_chains=100, num_betas=10000, base_bias=None, confidence=0.95):
+    # Estimates log Z of the RBM with annealed importance sampling (Salakhutdinov & Murray, 2008).
+    # All num_chains annealing runs are simulated together as one num_chains x VISIBLE_UNITS tensor.
+    # Each run starts from an exact sample of the base-rate model (no weights, visible biases base_bias)
+    # and is moved through num_betas intermediate models p_beta(v) by one Gibbs step per temperature.
+    # Returns log Z and the bounds of a confidence interval from the spread of the importance weights.
+    device = rbm.weights.device
+    if base_bias is None:
+        base_bias = torch.zeros(rbm.num_visible, device=device)
+    betas = torch.linspace(0, 1, num_betas, dtype=torch.float64).tolist()
+    log_z_base = rbm.num_hidden * math.log(2) + torch.nn.functional.softplus(base_bias).sum().item()
+
+    visible = torch.bernoulli(torch.sigmoid(base_bias).expand(num_chains, rbm.num_visible))
+    log_weights = torch.zeros(num_chains, dtype=torch.float64, device=device)
+    for previous, beta in zip(betas[:-1], betas[1:]):
+        # log p*_beta(v) - log p*_previous(v), with p*_beta(v) = exp((1-beta) b_A.v + beta b.v) prod_j (1 + exp(beta (c_j + v.W_j)))
+        hidden_activations = (torch.matmul(visible, rbm.weights) + rbm.hidden_bias).double()
+        visible_term = torch.matmul(visible, rbm.visible_bias - base_bias).double()
+        log_weights += (beta - previous) * visible_term \
+            + (torch.nn.functional.softplus(beta * hidden_activations) - torch.nn.functional.softplus(previous * hidden_activations)).sum(dim=1)
+        # one Gibbs step that leaves p_beta unchanged
+        hidden = torch.bernoulli(torch.sigmoid(beta * hidden_activations.float()))
+        visible_activations = (1 - beta) * base_bias + beta * (torch.matmul(hidden, rbm.weights.t()) + rbm.visible_bias)
+        visible = torch.bernoulli(torch.sigmoid(visible_activations))
+
+    # log of the mean importance weight and of mean -/+ z standard errors, relative to the largest weight
+    top = log_weights.max().item()
+    weights = torch.exp(log_weights - top)
+    mean = weights.mean().item()
+    error = NormalDist().inv_cdf(0.5 + confidence / 2) * weights.std(unbiased=False).item() / math.sqrt(num_chains)
+    lower = math.log(mean - error) if mean > error else -math.inf
+    return log_z_base + top + math.log(mean), log_z_base + top + lower, log_z_base + top + math.log(mean + error)
+
+def save_checkpoint(path, rbm, epoch, batch_index, epoch_error, batch_size):
+    # Saves the RBM's parameters and momentum buffers, the random number generator states,
+    # the training position (the next batch_index of epoch, and the error summed so far in that epoch)
+    # and the RBM's hyperparameters and batch size, which the position and state depend on.
+    # The checkpoint is written to a temporary file and then renamed over path, so a job killed
+    # while saving always leaves the previous complete checkpoint behind.
+    checkpoint = {'rbm': rbm.state_dict(), 'hyperparameters': dict(rbm.hyperparameters(), batch_size=batch_size),
+                  'epoch': epoch, 'batch_index': batch_index,
+                  'epoch_error': float(epoch_error), 'torch_rng_state': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        checkpoint['cuda_rng_state'] = torch.cuda.get_rng_state_all()
+    temporary_path = path + '.tmp'
+    torch.save(checkpoint, temporary_path)
+    os.replace(temporary_path, path)
+
+def load_checkpoint(path, rbm, batch_size):
+    # Restores a checkpoint written by save_checkpoint() into rbm and the random number
+    # generators, and returns the position to continue from: (epoch, batch_index, epoch_error).
+    # Raises ValueError, leaving rbm untouched, if the checkpoint was saved with different
+    # hyperparameters or batch size.
+    checkpoint = torch.load(path, map_location='cpu')
+    expected = dict(rbm.hyperparameters(), batch_size=batch_size)
+    saved = checkpoint.get('hyperparameters')
+    if saved is None:
+        raise ValueError('%s was saved without its hyperparameters' % path)
+    mismatches = ['%s=%s (now %s)' % (name, saved.get(name), value)
+                  for name, value in expected.items() if saved.get(name) != value]
+    if mismatches:
+        raise ValueError('%s was saved with different settings: %s' % (path, ', '.join(mismatches)))
+    rbm.load_state_dict(checkpoint['rbm'])
+    torch.set_rng_state(checkpoint['torch_rng_state'])
+    if 'cuda_rng_state' in checkpoint and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(checkpoint['cuda_rng_state'])
+    return checkpoint['epoch'], checkpoint['batch_index'], checkpoint['epoch_error']
+
+def extract_features(rbm, data_loader, path, labels_path):
+    # Streams the hidden unit probabilities of every image in data_loader to a memory-mapped
+    # float32 .npy file at path, and the labels to the int64 .npy file labels_path, one batch at a time,
+    # so the feature matrix never has to fit in memory. Returns both arrays, opened read-only.
+    num_samples = len(data_loader.dataset)
+    features = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(num_samples, rbm.num_hidden))
+    labels = np.lib.format.open_memmap(labels_path, mode='w+', dtype=np.int64, shape=(num_samples,))
+    start = 0
+    for batch, batch_labels in data_loader:
+        batch = batch.view(len(batch), rbm.num_visible)  # flatten input data
+        if rbm.use_cuda:
+            batch = batch.cuda()
+        features[start:start + len(batch)] = rbm.sample_hidden(batch).cpu().numpy()
+        labels[start:start + len(batch)] = batch_labels.cpu().numpy()
+        start += len(batch)
+    features.flush()
+    labels.flush()
+    del features, labels
+    return np.load(path, mmap_mode='r'), np.load(labels_path, mmap_mode='r')
+
+def train_classifier(features, labels, epochs=5, chunk_size=10000):
+    # Fits a logistic regression classifier by stochastic gradient descent, one chunk of
+    # chunk_size rows of the (memory-mapped) feature file at a time, visiting the chunks
+    # in a new random order each epoch. Only one chunk is held in memory.
+    classifier = SGDClassifier(loss='log_loss', alpha=1e-5)
+    classes = np.unique(labels)
+    starts = np.arange(0, len(features), chunk_size)
+    for epoch in range(epochs):
+        for start in np.random.permutation(starts):
+            classifier.partial_fit(features[start:start + chunk_size], labels[start:start + chunk_size], classes=classes)
+    return classifier
+
+def count_correct(classifier, features, labels, chunk_size=10000):
+    # number of correctly classified rows, predicted one chunk at a time
+    correct = 0
+    for start in range(0, len(features), chunk_size):
+        predictions = classifier.predict(features[start:start + chunk_size])
+        correct += int(np.sum(predictions == labels[start:start + chunk_size]))
+    return correct
+
+class DBN():
+    # Deep belief network: a stack of RBMs trained greedily, one layer at a time.
+    # Each layer's hidden unit probabilities for the whole training set are cached to a
+    # float16 memory-mapped file, and the next layer trains from that file, so lower
+    # layers run once per layer instead of once per batch of every higher layer's epochs.
+
+    def __init__(self, num_visible, hidden_layers, k, use_cuda=True, **rbm_options):
+        self.num_visible    = num_visible
+        self.num_hidden     = hidden_layers[-1]
+        self.use_cuda       = use_cuda
+        layer_sizes = [num_visible] + list(hidden_layers)
+        self.rbms = [RBM(layer_sizes[i], layer_sizes[i + 1], k, use_cuda=use_cuda, **rbm_options) for i in range(len(hidden_layers))]
+
+    def sample_hidden(self, visible_probabilities):
+        # hidden unit probabilities of the top layer, passing probabilities up through every layer
+        for rbm in self.rbms:
+            visible_probabilities = rbm.sample_hidden(visible_probabilities)
+        return visible_probabilities
+
+    def _batches(self, data_loader, inputs, shuffle=True):
+        # batches of the first layer's input (images from data_loader) or of a cached layer (inputs),
+        # read from the cache in data_loader.batch_size slices, in random order if shuffle
+        if inputs is None:
+            for batch, _ in data_loader:
+                batch = batch.view(len(batch), self.num_visible)  # flatten input data
+                yield batch.cuda() if self.use_cuda else batch
+            return
+        starts = np.arange(0, len(inputs), data_loader.batch_size)
+        if shuffle:
+            starts = np.random.permutation(starts)
+        for start in starts:
+            batch = torch.from_numpy(np.asarray(inputs[start:start + data_loader.batch_size], dtype=np.float32))
+            yield batch.cuda() if self.use_cuda else batch
+
+    def train(self, data_loader, epochs, cache_folder):
+        # greedy layer-wise training; layer l's features are cached in cache_folder/dbn_layer<l>.npy
+        inputs = None
+        for layer, rbm in enumerate(self.rbms):
+            for epoch in range(epochs):
+                epoch_error = 0.0
+                for batch in self._batches(data_loader, inputs):
+                    epoch_error += rbm.contrastive_divergence(batch)
+                print('Layer %d Epoch Error (epoch=%d): %.4f' % (layer, epoch, epoch_error))
+
+            if layer < len(self.rbms) - 1:
+                path = os.path.join(cache_folder, 'dbn_layer%d.npy' % layer)
+                cache = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=(len(data_loader.dataset), rbm.num_hidden))
+                start = 0
+                for batch in self._batches(data_loader, inputs, shuffle=False):
+                    cache[start:start + len(batch)] = rbm.sample_hidden(batch).cpu().numpy()
+                    start += len(batch)
+                cache.flush()
+                del cache
+                inputs = np.load(path, mmap_mode='r')
+
 ########## DEFINITIONS DONE ##########
 
 ########## LOAD DATASET ##########
 print('Loading MNIST dataset of images of digits between 0 and 9 ...')
 
+# the images are decoded once into tensors of pixel values in [0, 1], kept on the GPU if there is one,
+# and batches are slices of those tensors
+
 # training data
-train_dataset = torchvision.datasets.MNIST(root=DATA_FOLDER, train=True, transform=torchvision.transforms.ToTensor(), download=True)
-train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=BATCH_SIZE)
+train_dataset = TensorMNIST(DATA_FOLDER, train=True, download=True, device='cuda' if CUDA else 'cpu')
+train_loader = BatchLoader(train_dataset, batch_size=BATCH_SIZE)
 
 # test data
-test_dataset = torchvision.datasets.MNIST(root=DATA_FOLDER, train=False, transform=torchvision.transforms.ToTensor(), download=True)
-test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=BATCH_SIZE)
+test_dataset = TensorMNIST(DATA_FOLDER, train=False, download=True, device='cuda' if CUDA else 'cpu')
+test_loader = BatchLoader(test_dataset, batch_size=BATCH_SIZE)
 
 
 ########## TRAINING RBM ##########
 print('Training RBM for %d epochs ...' % EPOCHS)
 # create RBM network with one visible and one hidden laayer
-rbm = RBM(VISIBLE_UNITS, HIDDEN_UNITS, CD_K, use_cuda=CUDA)
-
-for epoch in range(EPOCHS):
+rbm = RBM(VISIBLE_UNITS, HIDDEN_UNITS, CD_K, use_cuda=CUDA,
+          persistent=PERSISTENT, num_particles=FANTASY_PARTICLES, num_temperatures=TEMPERATURES)
+
+# continue from the last checkpoint, if there is one
+start_epoch, start_batch, start_error = 0, 0, 0.0
+if os.path.exists(CHECKPOINT_FILE):
+    try:
+        start_epoch, start_batch, start_error = load_checkpoint(CHECKPOINT_FILE, rbm, BATCH_SIZE)
+    except ValueError as error:
+        sys.exit('Cannot resume: %s. Delete %s to start training afresh.' % (error, CHECKPOINT_FILE))
+    print('Resuming from %s at epoch %d, batch %d' % (CHECKPOINT_FILE, start_epoch, start_batch))
+os.makedirs(os.path.dirname(CHECKPOINT_FILE) or '.', exist_ok=True)
+
+for epoch in range(start_epoch, EPOCHS):
     epoch_error = 0.0
+    first_batch = 0
 
-    for batch, _ in train_loader:
+    if epoch == start_epoch and start_batch > 0:
+        # mid-epoch resume: train_loader is not shuffled, so skip the batches already trained on
+        epoch_error = start_error
+        first_batch = start_batch
+
+    for batch_index, (batch, _) in enumerate(train_loader.batches(first_batch), start=first_batch):
         batch = batch.view(len(batch), VISIBLE_UNITS)  # flatten input data
 
         if CUDA:
@@ -183,48 +496,76 @@ for epoch in range(EPOCHS):
 
         epoch_error += batch_error
 
+        if CHECKPOINT_EVERY and (batch_index + 1) % CHECKPOINT_EVERY == 0:
+            save_checkpoint(CHECKPOINT_FILE, rbm, epoch, batch_index + 1, epoch_error, BATCH_SIZE)
+
     print('Epoch Error (epoch=%d): %.4f' % (epoch, epoch_error))
+    save_checkpoint(CHECKPOINT_FILE, rbm, epoch + 1, 0, 0.0, BATCH_SIZE)
 
 
 ########## EXTRACT FEATURES ##########
-print('Extracting features...')
+print('Extracting features to %s ...' % FEATURE_FOLDER)
 
-train_features = np.zeros((len(train_dataset), HIDDEN_UNITS))
-train_labels = np.zeros(len(train_dataset))
-test_features = np.zeros((len(test_dataset), HIDDEN_UNITS))
-test_labels = np.zeros(len(test_dataset))
+os.makedirs(FEATURE_FOLDER, exist_ok=True)
+# train_features = 60,000 hidden unit outputs (1 per training vector) x 128 hidden units, as float32 on disk
+train_features, train_labels = extract_features(rbm, train_loader, os.path.join(FEATURE_FOLDER, 'train_features.npy'),
+                                                os.path.join(FEATURE_FOLDER, 'train_labels.npy'))
+test_features, test_labels = extract_features(rbm, test_loader, os.path.join(FEATURE_FOLDER, 'test_features.npy'),
+                                              os.path.join(FEATURE_FOLDER, 'test_labels.npy'))
 
-for i, (batch, labels) in enumerate(train_loader):
-    batch = batch.view(len(batch), VISIBLE_UNITS)  # flatten input data
 
-    if CUDA:
-        batch = batch.cuda()
+########## CLASSIFICATION ##########
+print('Fitting linear classifier ...')
 
-    train_features[i*BATCH_SIZE:i*BATCH_SIZE+len(batch)] = rbm.sample_hidden(batch).cpu().numpy()
-    train_labels[i*BATCH_SIZE:i*BATCH_SIZE+len(batch)] = labels.numpy()
+# use outputs of trained hidden units to fit linear classifier to correct labels,
+# streaming CLASSIFIER_CHUNK rows at a time from the feature file ...
+clf = train_classifier(train_features, train_labels, CLASSIFIER_EPOCHS, CLASSIFIER_CHUNK)
+# use fitted linear classifier to classify test data ... test_features = 10,000 hidden layer states, 1 per test vector
+correct = count_correct(clf, test_features, test_labels, CLASSIFIER_CHUNK)
 
-for i, (batch, labels) in enumerate(test_loader):
-    batch = batch.view(len(batch), VISIBLE_UNITS)  # flatten input data
+# compare 10,000 classification results on test data with correct class labels ...
+print('Result: %d/%d' % (correct, len(test_labels)))
+# prints out (for example, on test data) Result: 9244/10000 = 92.44%
 
-    if CUDA:
-        batch = batch.cuda()
 
-    test_features[i*BATCH_SIZE:i*BATCH_SIZE+len(batch)] = rbm.sample_hidden(batch).cpu().numpy()
-    test_labels[i*BATCH_SIZE:i*BATCH_SIZE+len(batch)] = labels.numpy()
+########## DEEP BELIEF NETWORK ##########
+if DBN_HIDDEN_UNITS:
+    print('Training %d-layer DBN %s ...' % (len(DBN_HIDDEN_UNITS), DBN_HIDDEN_UNITS))
+    dbn = DBN(VISIBLE_UNITS, DBN_HIDDEN_UNITS, CD_K, use_cuda=CUDA)
+    dbn.train(train_loader, EPOCHS, FEATURE_FOLDER)
 
+    # classify the top layer's features the same way as the single RBM's
+    dbn_train_features, dbn_train_labels = extract_features(dbn, train_loader, os.path.join(FEATURE_FOLDER, 'dbn_train_features.npy'),
+                                                            os.path.join(FEATURE_FOLDER, 'dbn_train_labels.npy'))
+    dbn_test_features, dbn_test_labels = extract_features(dbn, test_loader, os.path.join(FEATURE_FOLDER, 'dbn_test_features.npy'),
+                                                          os.path.join(FEATURE_FOLDER, 'dbn_test_labels.npy'))
+    dbn_clf = train_classifier(dbn_train_features, dbn_train_labels, CLASSIFIER_EPOCHS, CLASSIFIER_CHUNK)
+    print('DBN Result: %d/%d' % (count_correct(dbn_clf, dbn_test_features, dbn_test_labels, CLASSIFIER_CHUNK), len(dbn_test_labels)))
 
-########## CLASSIFICATION ##########
-print('Fitting linear classifier ...')
 
-clf = LogisticRegression(solver='newton-cg',multi_class='auto')
-# train_features = 60,000 hidden unit outputs (1 per training vector) x 128 hidden units
-# use outputs of trained hidden units to fit linear classifier to correct labels ...
-clf.fit(train_features, train_labels)
-# use fitted linear classifier to classify test data ... test_features = 10,000 hidden layer states, 1 per test vector
-predictions = clf.predict(test_features) # predictions = 10,000 classifications (0-9)
+########## LOG-LIKELIHOOD ##########
+print('Estimating log-likelihood with AIS (%d chains, %d temperatures) ...' % (AIS_CHAINS, AIS_BETAS))
 
-# compare 10,000 classification results on test data with correct class labels ...
-print('Result: %d/%d' % (sum(predictions == test_labels), test_labels.shape[0]))
-# prints out (for example, on test data) Result: 9244/10000 = 92.44%
+# base-rate model = independent pixels with the same mean intensity as the training images
+pixel_means = train_dataset.data.view(len(train_dataset), VISIBLE_UNITS).mean(dim=0).clamp(1e-3, 1 - 1e-3)
+base_bias = torch.log(pixel_means) - torch.log(1 - pixel_means)
+
+if CUDA:
+    base_bias = base_bias.cuda()
+
+log_z, log_z_lower, log_z_upper = annealed_importance_sampling(rbm, AIS_CHAINS, AIS_BETAS, base_bias)
+print('log Z = %.2f (95%% interval %.2f to %.2f)' % (log_z, log_z_lower, log_z_upper))
+
+# average log p(v) = -F(v) - log Z over the binarized test images
+test_free_energy = 0.0
+for batch, _ in test_loader:
+    batch = (batch.view(len(batch), VISIBLE_UNITS) >= 0.5).float()  # binarize input data
+
+    if CUDA:
+        batch = batch.cuda()
+
+    test_free_energy += rbm.free_energy(batch).sum().item()
+
+print('Average test log-likelihood: %.2f nats' % (-test_free_energy / len(test_dataset) - log_z))
 
 ########## THE END ##########
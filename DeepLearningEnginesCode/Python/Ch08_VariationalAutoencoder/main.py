@@ -36,15 +36,20 @@ The code below makes a VAE:
 """
 from __future__ import print_function
 import argparse
+import os
+import sys
 import torch
 import torch.utils.data
 from torch import nn, optim
 from torch.nn import functional as F
-from torchvision import datasets, transforms
 from torchvision.utils import save_image
 import matplotlib.pyplot as plt
 from torch.autograd import Variable
 
+# mnist_tensors.py is shared with Ch07 and Ch09 and lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mnist_tensors import TensorMNIST, BatchLoader
+
 ########## set parameter values ##########
 
 ZDIMS = 20 # number of latent variables 
@@ -83,22 +88,19 @@ torch.manual_seed(args.seed)
 
 device = torch.device("cuda" if args.cuda else "cpu")
 
-# DataLoader instances will load tensors directly into GPU memory
-kwargs = {'num_workers': 1, 'pin_memory': True} if args.cuda else {}
-
 ########## create data loaders ##########
 
-# Download or load downloaded MNIST dataset
+# Download or load downloaded MNIST dataset, decoded once into tensors of
+# pixel values in [0, 1] that are kept on the device used for training
 # shuffle data at every epoch
-train_loader = torch.utils.data.DataLoader(
-    datasets.MNIST('../data', train=True, download=True,
-                   transform=transforms.ToTensor()),
-    batch_size=args.batch_size, shuffle=True, **kwargs)
+train_loader = BatchLoader(
+    TensorMNIST('../data', train=True, download=True, device=device),
+    batch_size=args.batch_size, shuffle=True)
 
 # Same for test data
-test_loader = torch.utils.data.DataLoader(
-    datasets.MNIST('../data', train=False, transform=transforms.ToTensor()),
-    batch_size=args.batch_size, shuffle=True, **kwargs)
+test_loader = BatchLoader(
+    TensorMNIST('../data', train=False, device=device),
+    batch_size=args.batch_size, shuffle=True)
 
 ########## define classes ##########
 
@@ -16,11 +16,23 @@ After 10 epochs:
 
 from __future__ import print_function
 import argparse
+import copy
+import io
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from torchvision import datasets, transforms
+
+# mnist_tensors.py is shared with Ch07 and Ch08 and lives in the parent folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mnist_tensors import TensorMNIST, BatchLoader, PrefetchLoader
 
 ########## define classes ##########
 
@@ -37,16 +49,25 @@ class Net(nn.Module):
         x = F.max_pool2d(x, 2, 2)
         x = F.relu(self.conv2(x))
         x = F.max_pool2d(x, 2, 2)
-        x = x.view(-1, 4*4*50)
+        x = x.reshape(-1, 4*4*50)
         x = F.relu(self.fc1(x))
         x = self.fc2(x)
         return F.log_softmax(x, dim=1)
 
 ########## define functions ##########
 
+def synchronize(device):
+    # wait for queued CUDA kernels so that wall-clock times include them
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
 def train(args, model, device, train_loader, optimizer, epoch):
     model.train()
+    data_time = compute_time = 0
+    end = time.perf_counter()
     for batch_idx, (data, target) in enumerate(train_loader):
+        start = time.perf_counter()
+        data_time += start - end # time spent waiting for this batch
         data, target = data.to(device), target.to(device)
         optimizer.zero_grad()
         output = model(data)
@@ -57,6 +78,11 @@ def train(args, model, device, train_loader, optimizer, epoch):
             print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
                 epoch, batch_idx * len(data), len(train_loader.dataset),
                 100. * batch_idx / len(train_loader), loss.item()))
+        synchronize(device)
+        end = time.perf_counter()
+        compute_time += end - start
+    print('Train Epoch: {} waited {:.2f}s for data, computed for {:.2f}s ({:.0f}% of the time waiting)'.format(
+        epoch, data_time, compute_time, 100. * data_time / (data_time + compute_time)))
 
 def test(args, model, device, test_loader):
     model.eval()
@@ -75,6 +101,152 @@ def test(args, model, device, test_loader):
     print('\nTest set: Average loss: {:.4f}, Accuracy: {}/{} ({:.0f}%)\n'.format(
         test_loss, correct, len(test_loader.dataset),
         100. * correct / len(test_loader.dataset)))
+    return test_loss, correct / len(test_loader.dataset)
+
+def quantize(model, calibration_loader, num_batches):
+    # Post-training static quantization: returns an int8 copy of the model for CPU inference.
+    # Observers record the range of every activation over num_batches batches of
+    # calibration_loader, which fixes the scale and zero point of each int8 tensor;
+    # conv1/conv2/fc1 are fused with the relu that follows them.
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    model = copy.deepcopy(model).cpu().eval()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # torch.ao.quantization's deprecation notices
+        example, _ = next(iter(calibration_loader))
+        prepared = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine),
+                              (example.cpu(),))
+        with torch.no_grad():
+            for batch_idx, (data, target) in enumerate(calibration_loader):
+                if batch_idx == num_batches:
+                    break
+                prepared(data.cpu())
+        return convert_fx(prepared)
+
+def model_size_mb(model):
+    # size of the model's serialized state_dict in MB
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+def compare_quantized(args, model, train_loader, test_loader):
+    # Quantizes the trained model, evaluates the float32 and the int8 model on the CPU
+    # and prints their accuracy, test batch latency and size side by side.
+    quantized = quantize(model, train_loader, args.calibration_batches)
+    cpu = torch.device('cpu')
+    rows = []
+    for name, candidate in (('float32', copy.deepcopy(model).to(cpu)), ('int8', quantized)):
+        print('{} model:'.format(name))
+        start = time.perf_counter()
+        test_loss, accuracy = test(args, candidate, cpu, test_loader)
+        latency = 1000 * (time.perf_counter() - start) / len(test_loader)
+        rows.append((name, accuracy, latency, model_size_mb(candidate)))
+    print('{:>8} {:>9} {:>17} {:>10}'.format('model', 'accuracy', 'ms/test batch', 'size MB'))
+    for row in rows:
+        print('{:>8} {:>8.2f}% {:>17.2f} {:>10.2f}'.format(row[0], 100 * row[1], row[2], row[3]))
+    print('int8 vs float32: {:+.2f}% accuracy, {:.1f}x faster, {:.1f}x smaller'.format(
+        100 * (rows[1][1] - rows[0][1]), rows[0][2] / rows[1][2], rows[0][3] / rows[1][3]))
+    return quantized
+
+def peak_rss_mb():
+    # peak resident memory of this process so far in MB (None where unavailable)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10 # bytes on macOS, kB elsewhere
+
+def endless(loader):
+    # the loader's batches, starting a new epoch whenever one runs out
+    while True:
+        for batch in loader:
+            yield batch
+
+def benchmark_run(model, device, batches, iterations, warmup, optimizer=None):
+    # Times warmup + iterations batches of training (with optimizer) or inference,
+    # splitting each batch's time into data, forward, backward and step; returns the
+    # per-phase times of the measured batches as an (iterations, 4) array in seconds
+    # and the number of samples they contained.
+    model.train(optimizer is not None)
+    times = np.zeros((iterations, 4))
+    samples = 0
+    for i in range(-warmup, iterations):
+        clock = [time.perf_counter()]
+        data, target = next(batches)
+        data, target = data.to(device), target.to(device)
+        synchronize(device)
+        clock.append(time.perf_counter())
+        if optimizer is None:
+            with torch.no_grad():
+                model(data)
+            synchronize(device)
+            clock += [time.perf_counter()] * 3
+        else:
+            optimizer.zero_grad()
+            loss = F.nll_loss(model(data), target)
+            synchronize(device)
+            clock.append(time.perf_counter())
+            loss.backward()
+            synchronize(device)
+            clock.append(time.perf_counter())
+            optimizer.step()
+            synchronize(device)
+            clock.append(time.perf_counter())
+        if i >= 0:
+            times[i] = np.diff(clock)
+            samples += len(data)
+    return times, samples
+
+def benchmark(args, device, train_dataset, test_dataset):
+    # Benchmark mode: for every combination of batch size and thread count, measures
+    # training and inference throughput, per-batch latency percentiles, the time
+    # breakdown per phase and peak memory, prints a table and writes the results as JSON.
+    # Peak RSS is that of the whole process, so it can only grow from one configuration to
+    # the next; benchmark one configuration per run to compare memory use.
+    batch_sizes = [int(size) for size in args.benchmark_batch_sizes.split(',')]
+    thread_counts = [int(threads) for threads in args.benchmark_threads.split(',')]
+    results = []
+    print('{:>5} {:>7} {:>9} {:>10} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+        'mode', 'batch', 'threads', 'samples/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'data', 'forward', 'backward', 'step'))
+    for batch_size in batch_sizes:
+        # one set of loaders (and workers) per batch size, shared by every thread count,
+        # so that worker start-up is not part of any measurement
+        loaders = {mode: PrefetchLoader(BatchLoader(dataset, batch_size=batch_size, shuffle=True),
+                                        args.workers, args.prefetch, args.worker_processes)
+                   for mode, dataset in (('train', train_dataset), ('infer', test_dataset))}
+        batches = {mode: endless(loader) for mode, loader in loaders.items()}
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            torch.manual_seed(args.seed)
+            model = Net().to(device)
+            optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum)
+            for mode in ('train', 'infer'):
+                times, samples = benchmark_run(model, device, batches[mode], args.benchmark_iterations,
+                                               args.benchmark_warmup, optimizer if mode == 'train' else None)
+                latency = 1000 * times.sum(axis=1)
+                result = {'mode': mode, 'batch_size': batch_size, 'threads': threads,
+                          'samples_per_second': samples / times.sum(),
+                          'latency_ms': {'mean': latency.mean(), 'p50': np.percentile(latency, 50),
+                                         'p90': np.percentile(latency, 90), 'p99': np.percentile(latency, 99)},
+                          'breakdown_ms': dict(zip(('data', 'forward', 'backward', 'step'),
+                                                   1000 * times.mean(axis=0))),
+                          'peak_rss_mb': peak_rss_mb()}
+                results.append(result)
+                print('{:>5} {:>7} {:>9} {:>10.0f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}'.format(
+                    mode, batch_size, threads, result['samples_per_second'],
+                    *[result['latency_ms'][p] for p in ('p50', 'p90', 'p99')], *result['breakdown_ms'].values()))
+        for loader in loaders.values():
+            loader.close()
+
+    report = {'device': str(device), 'torch': torch.__version__, 'python': platform.python_version(),
+              'machine': platform.machine(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+              'warmup': args.benchmark_warmup, 'iterations': args.benchmark_iterations,
+              'workers': args.workers, 'prefetch': args.prefetch, 'results': results}
+    with open(args.benchmark_output, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+    print('Benchmark results written to ' + args.benchmark_output)
 
 def main():
     numepochs = 2;
@@ -89,6 +261,15 @@ def main():
     parser.add_argument('--test-batch-size', type=int, default=1000, metavar='N',
                         help='input batch size for testing (default: 1000)')
     
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help='background workers preparing batches; 0 prepares them in the training loop (default: 0)')
+    
+    parser.add_argument('--prefetch', type=int, default=2, metavar='N',
+                        help='batches each worker prepares ahead of training (default: 2)')
+    
+    parser.add_argument('--worker-processes', action='store_true', default=False,
+                        help='use worker processes instead of threads (CPU only)')
+    
     parser.add_argument('--epochs', type=int, default=numepochs, metavar='N',
                         help='number of epochs to train (default: 10)')
     
@@ -110,6 +291,30 @@ def main():
     parser.add_argument('--save-model', action='store_true', default=False,
                         help='For Saving the current Model')
     
+    parser.add_argument('--quantize', action='store_true', default=False,
+                        help='after training, quantize the model to int8 and compare it with float32 on the CPU')
+    
+    parser.add_argument('--calibration-batches', type=int, default=10, metavar='N',
+                        help='training batches used to calibrate the int8 model (default: 10)')
+    
+    parser.add_argument('--benchmark', action='store_true', default=False,
+                        help='measure training and inference speed instead of training')
+    
+    parser.add_argument('--benchmark-batch-sizes', default='16,64,256', metavar='LIST',
+                        help='comma-separated batch sizes to benchmark (default: 16,64,256)')
+    
+    parser.add_argument('--benchmark-threads', default=str(torch.get_num_threads()), metavar='LIST',
+                        help='comma-separated numbers of CPU threads to benchmark (default: all)')
+    
+    parser.add_argument('--benchmark-warmup', type=int, default=10, metavar='N',
+                        help='batches run before measuring (default: 10)')
+    
+    parser.add_argument('--benchmark-iterations', type=int, default=100, metavar='N',
+                        help='batches measured per configuration (default: 100)')
+    
+    parser.add_argument('--benchmark-output', default='benchmark.json', metavar='FILE',
+                        help='JSON file for the benchmark results (default: benchmark.json)')
+    
     args = parser.parse_args()
     
     use_cuda = not args.no_cuda and torch.cuda.is_available()
@@ -118,20 +323,22 @@ def main():
 
     device = torch.device("cuda" if use_cuda else "cpu")
 
-    kwargs = {'num_workers': 1, 'pin_memory': True} if use_cuda else {}
-    train_loader = torch.utils.data.DataLoader(
-        datasets.MNIST('../data', train=True, download=True,
-                       transform=transforms.Compose([
-                           transforms.ToTensor(),
-                           transforms.Normalize((0.1307,), (0.3081,))
-                       ])),
-        batch_size=args.batch_size, shuffle=True, **kwargs)
-    test_loader = torch.utils.data.DataLoader(
-        datasets.MNIST('../data', train=False, transform=transforms.Compose([
-                           transforms.ToTensor(),
-                           transforms.Normalize((0.1307,), (0.3081,))
-                       ])),
-        batch_size=args.test_batch_size, shuffle=True, **kwargs)
+    # MNIST decoded once into tensors on the training device, normalised in one step
+    # with the dataset's mean and standard deviation; batches are slices of those tensors
+    train_loader = BatchLoader(
+        TensorMNIST('../data', train=True, download=True, mean=0.1307, std=0.3081, device=device),
+        batch_size=args.batch_size, shuffle=True)
+    test_loader = BatchLoader(
+        TensorMNIST('../data', train=False, mean=0.1307, std=0.3081, device=device),
+        batch_size=args.test_batch_size, shuffle=True)
+
+    if args.benchmark:
+        benchmark(args, device, train_loader.dataset, test_loader.dataset)
+        return
+
+    # workers persist across epochs, preparing the next batches while the model computes
+    train_loader = PrefetchLoader(train_loader, args.workers, args.prefetch, args.worker_processes)
+    test_loader = PrefetchLoader(test_loader, args.workers, args.prefetch, args.worker_processes)
 
     model = Net().to(device)
     optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum)
@@ -140,6 +347,12 @@ def main():
         train(args, model, device, train_loader, optimizer, epoch)
         test(args, model, device, test_loader)
 
+    if args.quantize:
+        compare_quantized(args, model, train_loader, test_loader)
+
+    train_loader.close()
+    test_loader.close()
+
     if (args.save_model):
         torch.save(model.state_dict(),"mnist_cnn.pt")
         
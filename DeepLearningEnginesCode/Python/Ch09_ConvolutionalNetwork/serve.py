@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter 9: Deep Backprop Network:
+Local inference server for a convolutional network trained with main.py --save-model.
+
+Description: loads mnist_cnn.pt once and classifies 28x28 digit images sent over HTTP.
+Requests arriving at the same time are batched together: the first waiting request opens
+a batch, which is run through Net.forward as soon as it holds --max-batch-size images or
+--max-wait-ms milliseconds have passed, whichever comes first.
+
+    python main.py --save-model
+    python serve.py --port 8000
+
+POST /predict with either
+    JSON {"image": [...784 pixels...]} or {"images": [[...], ...]}, pixels in [0, 1]
+        (flat, or nested 28x28), or
+    application/octet-stream: 784 bytes (uint8 pixels 0-255) per image
+returns JSON {"predictions": [digit, ...], "probabilities": [[p0, ..., p9], ...]}.
+GET /stats returns the number of requests, images and batches served so far.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from main import Net
+
+MEAN, STD = 0.1307, 0.3081 # normalisation used in training
+
+########## define classes ##########
+
+class DynamicBatcher(object):
+    # Collects the images of concurrent requests into batches for one model.
+    # submit() queues a (N, 1, 28, 28) tensor of normalised images and returns a Future
+    # of their (N, 10) class probabilities; a single worker thread runs the batches.
+
+    def __init__(self, model, device, max_batch_size=64, max_wait=0.005):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.pending = None # a request taken from the queue that did not fit in the last batch
+        self.stats = {'requests': 0, 'images': 0, 'batches': 0}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, images):
+        result = Future()
+        self.requests.put((images, result))
+        return result
+
+    def _next_request(self, timeout=None):
+        if self.pending is not None:
+            request, self.pending = self.pending, None
+            return request
+        return self.requests.get(timeout=timeout)
+
+    def _collect(self):
+        # blocks for the first request, then adds requests until the batch is full or
+        # max_wait has passed since the first one arrived
+        batch = [self._next_request()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next_request(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                self.pending = request # starts the next batch
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                images = torch.cat([images for images, result in batch]).to(self.device)
+                with torch.no_grad():
+                    probabilities = self.model(images).exp().cpu()
+            except Exception as error:
+                for images, result in batch:
+                    result.set_exception(error)
+                continue
+            start = 0
+            for images, result in batch:
+                result.set_result(probabilities[start:start + len(images)])
+                start += len(images)
+            self.stats['requests'] += len(batch)
+            self.stats['images'] += len(probabilities)
+            self.stats['batches'] += 1
+
+def parse_images(body, content_type):
+    # the request body as a (N, 1, 28, 28) float32 tensor of normalised images
+    if content_type.startswith('application/octet-stream'):
+        if len(body) == 0 or len(body) % 784:
+            raise ValueError('expected 784 bytes per image, got {} bytes'.format(len(body)))
+        pixels = np.frombuffer(body, dtype=np.uint8).astype(np.float32) / 255
+    else:
+        request = json.loads(body)
+        images = [request['image']] if 'image' in request else request['images']
+        pixels = np.asarray(images, dtype=np.float32)
+        if pixels.size == 0 or pixels.size % 784 or pixels.size // 784 != len(images):
+            raise ValueError('expected images of 784 pixels (flat or 28x28)')
+    images = torch.from_numpy(pixels.reshape(-1, 1, 28, 28))
+    return images.sub_(MEAN).div_(STD)
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    batcher = None # set by main()
+    quiet = False
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._reply(404, {'error': 'unknown path ' + self.path})
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            images = parse_images(body, self.headers.get('Content-Type', 'application/json'))
+        except (ValueError, KeyError, TypeError) as error:
+            return self._reply(400, {'error': str(error)})
+        try:
+            probabilities = self.batcher.submit(images).result()
+        except Exception as error:
+            return self._reply(500, {'error': str(error)})
+        self._reply(200, {'predictions': probabilities.argmax(dim=1).tolist(),
+                          'probabilities': probabilities.tolist()})
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404, {'error': 'unknown path ' + self.path})
+        stats = dict(self.batcher.stats)
+        stats['mean_batch_size'] = stats['images'] / max(stats['batches'], 1)
+        self._reply(200, stats)
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class PredictionServer(ThreadingHTTPServer):
+    # one thread per connection; a deep listen backlog so bursts of concurrent clients
+    # are queued rather than refused (socketserver's default is 5)
+    request_queue_size = 1024
+    daemon_threads = True
+
+########## define functions ##########
+
+def main():
+    parser = argparse.ArgumentParser(description='MNIST inference server')
+
+    parser.add_argument('--model', default='mnist_cnn.pt', metavar='FILE',
+                        help='state_dict saved by main.py --save-model (default: mnist_cnn.pt)')
+
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: 8000)')
+
+    parser.add_argument('--max-batch-size', type=int, default=64, metavar='N',
+                        help='most images run through the network at once (default: 64)')
+
+    parser.add_argument('--max-wait-ms', type=float, default=5, metavar='MS',
+                        help='longest time a request waits for others to join its batch (default: 5)')
+
+    parser.add_argument('--no-cuda', action='store_true', default=False,
+                        help='disables CUDA inference')
+
+    parser.add_argument('--quiet', action='store_true', default=False,
+                        help='do not log every request')
+
+    args = parser.parse_args()
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    model = Net().to(device)
+    model.load_state_dict(torch.load(args.model, map_location=device))
+    model.eval()
+
+    PredictionHandler.batcher = DynamicBatcher(model, device, args.max_batch_size, args.max_wait_ms / 1000)
+    PredictionHandler.quiet = args.quiet
+    server = PredictionServer((args.host, args.port), PredictionHandler)
+    print('Serving {} on http://{}:{}/predict'.format(args.model, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
+
+########## The End ##########
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-tensorized MNIST, shared by Ch07_RestrictedBoltzmannMachine, Ch08_VariationalAutoencoder
+and Ch09_ConvolutionalNetwork.
+
+torchvision's MNIST dataset converts every image from PIL through transforms.ToTensor()
+each time it is used, one image at a time. Here the IDX files are decoded once into a
+single contiguous uint8 tensor per split, cached on disk (root/MNIST/tensors/*.pt), scaled
+and normalised with one vectorized operation, and batches are taken by slicing (or by
+indexing with a shuffled permutation) instead of calling __getitem__ per image.
+
+Usage (replacing datasets.MNIST and torch.utils.data.DataLoader):
+    train_dataset = TensorMNIST('../data', train=True, mean=0.1307, std=0.3081)
+    train_loader = BatchLoader(train_dataset, batch_size=64, shuffle=True)
+    for data, target in train_loader:
+        ...
+
+Wrapping a loader in PrefetchLoader(train_loader, num_workers=2) prepares the next batches
+in background workers while the current one is used.
+"""
+import gzip
+import math
+import os
+import queue
+import threading
+import traceback
+import numpy as np
+import torch
+import torch.multiprocessing
+
+FILES = {True: ('train-images-idx3-ubyte', 'train-labels-idx1-ubyte'),
+         False: ('t10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte')}
+
+def read_idx(path):
+    # decode an IDX file of unsigned bytes (optionally gzipped) into a uint8 tensor
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        content = f.read()
+    magic = int.from_bytes(content[0:4], 'big')
+    if magic >> 8 != 0x08:
+        raise ValueError('%s is not an IDX file of unsigned bytes' % path)
+    num_dims = magic & 0xff
+    shape = [int.from_bytes(content[4 + 4 * i:8 + 4 * i], 'big') for i in range(num_dims)]
+    data = np.frombuffer(content, dtype=np.uint8, offset=4 + 4 * num_dims)
+    return torch.from_numpy(data.reshape(shape).copy())
+
+def _raw_file(raw_folder, name):
+    # path of an IDX file in raw_folder, uncompressed or gzipped, or None
+    for path in (os.path.join(raw_folder, name), os.path.join(raw_folder, name + '.gz')):
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_tensors(root, train=True, download=True):
+    # Returns (images, labels) as uint8 tensors of shape (N, 28, 28) and (N,).
+    # The first call decodes the IDX files in root/MNIST/raw (downloading them with
+    # torchvision if necessary) and caches the tensors in root/MNIST/tensors; later
+    # calls only load the cache.
+    split = 'train' if train else 'test'
+    cache = os.path.join(root, 'MNIST', 'tensors', split + '.pt')
+    if os.path.exists(cache):
+        tensors = torch.load(cache)
+        return tensors['images'], tensors['labels']
+
+    raw_folder = os.path.join(root, 'MNIST', 'raw')
+    paths = [_raw_file(raw_folder, name) for name in FILES[train]]
+    if None in paths:
+        if not download:
+            raise RuntimeError('MNIST not found in %s; use download=True to download it' % raw_folder)
+        from torchvision import datasets
+        datasets.MNIST(root, train=train, download=True)
+        paths = [_raw_file(raw_folder, name) for name in FILES[train]]
+
+    images, labels = read_idx(paths[0]), read_idx(paths[1])
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    temporary = cache + '.tmp'
+    torch.save({'images': images, 'labels': labels}, temporary)
+    os.replace(temporary, cache)
+    return images, labels
+
+class TensorMNIST(torch.utils.data.Dataset):
+    # MNIST held as two tensors: data, float32 of shape (N, 1, 28, 28) with pixels scaled to
+    # [0, 1] and then normalised as (x - mean) / std, and targets, int64 of shape (N,).
+    # Both are stored on device. Indexing accepts an int, a slice or a tensor of indices and
+    # returns the (data, target) batch in one operation.
+
+    def __init__(self, root, train=True, download=True, mean=None, std=None, device='cpu'):
+        images, labels = load_tensors(root, train, download)
+        data = images.to(device=device, dtype=torch.float32).div_(255).unsqueeze_(1)
+        if mean is not None:
+            data.sub_(mean).div_(std)
+        self.data = data
+        self.targets = labels.to(device=device, dtype=torch.int64)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        return self.data[index], self.targets[index]
+
+class BatchLoader(object):
+    # Drop-in replacement for DataLoader over a TensorMNIST: yields (data, target) batches by
+    # slicing the dataset's tensors, or, with shuffle, by indexing them with consecutive slices
+    # of a new random permutation each epoch.
+
+    def __init__(self, dataset, batch_size=64, shuffle=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return math.ceil(len(self.dataset) / self.batch_size)
+
+    def __iter__(self):
+        return self.batches()
+
+    def batches(self, start_batch=0):
+        # the epoch's batches from batch number start_batch onwards
+        for index in self.indices(start_batch):
+            yield self.dataset[index]
+
+    def indices(self, start_batch=0):
+        # the index (a slice, or a tensor of shuffled indices) of each of the epoch's batches
+        num_samples = len(self.dataset)
+        if self.shuffle:
+            order = torch.randperm(num_samples, device=self.dataset.targets.device)
+        for start in range(start_batch * self.batch_size, num_samples, self.batch_size):
+            if self.shuffle:
+                yield order[start:start + self.batch_size]
+            else:
+                yield slice(start, start + self.batch_size)
+
+def _prefetch_worker(dataset, tasks, results, num_threads=None):
+    # Body of a PrefetchLoader worker: gathers the batch for each (epoch, number, index)
+    # task and puts (epoch, number, batch, error) on results, where error is the formatted
+    # traceback if gathering failed. Worker processes run torch single-threaded (num_threads=1),
+    # as DataLoader's do, so that several workers do not oversubscribe the cores.
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        epoch, number, index = task
+        try:
+            results.put((epoch, number, dataset[index], None))
+        except Exception:
+            results.put((epoch, number, None, traceback.format_exc()))
+
+class PrefetchLoader(object):
+    # Wraps a BatchLoader so that batches are gathered by num_workers background workers
+    # (threads, or processes with processes=True) while the training loop computes.
+    # Workers are started once and persist across epochs. At most prefetch batches per
+    # worker are in flight, which bounds the memory used by the queue, and batches are
+    # yielded in the same order as the wrapped loader's. num_workers=0 gathers each batch
+    # in the calling thread, like the wrapped loader. Call close() to stop the workers.
+    # Worker processes are started with 'spawn': a forked child of a process that has run
+    # multi-threaded torch operations can deadlock in its first torch call.
+
+    def __init__(self, loader, num_workers=2, prefetch=2, processes=False):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.batch_size = loader.batch_size
+        self.num_workers = num_workers
+        self.depth = max(1, num_workers * prefetch)
+        self.epoch = 0
+        self.workers = []
+        if num_workers == 0:
+            return
+        if processes:
+            if self.dataset.data.is_cuda:
+                raise ValueError('worker processes need a dataset in CPU memory; use threads for CUDA tensors')
+            context = torch.multiprocessing.get_context('spawn')
+            self.tasks, self.results = context.Queue(), context.Queue()
+            start = lambda: context.Process(target=_prefetch_worker, args=(self.dataset, self.tasks, self.results, 1), daemon=True)
+        else:
+            self.tasks, self.results = queue.Queue(), queue.Queue()
+            start = lambda: threading.Thread(target=_prefetch_worker, args=(self.dataset, self.tasks, self.results), daemon=True)
+        for i in range(num_workers):
+            worker = start()
+            worker.start()
+            self.workers.append(worker)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if not self.workers:
+            return iter(self.loader)
+        return self._prefetched()
+
+    def _prefetched(self):
+        # keeps self.depth batches requested ahead of the one being yielded
+        self.epoch += 1
+        indices = enumerate(self.loader.indices())
+        for i in range(self.depth):
+            self._request(indices)
+        arrived = {}
+        for number in range(len(self.loader)):
+            while number not in arrived:
+                epoch, arrived_number, batch, error = self._result()
+                if epoch != self.epoch:  # drop batches left over from an abandoned epoch
+                    continue
+                if error is not None:
+                    raise RuntimeError('prefetch worker failed on batch {}:\n{}'.format(arrived_number, error))
+                arrived[arrived_number] = batch
+            self._request(indices)
+            yield arrived.pop(number)
+
+    def _result(self):
+        # the next result from the workers, checking that they are still alive while waiting
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError('a prefetch worker exited unexpectedly')
+
+    def _request(self, indices):
+        task = next(indices, None)
+        if task is not None:
+            self.tasks.put((self.epoch,) + task)
+
+    def close(self):
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
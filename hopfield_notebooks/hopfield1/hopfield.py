@@ -11,11 +11,54 @@ import matplotlib.pyplot as plt
 from tqdm import tqdm, trange
 
 
+###############################################
+# bit-packed states: one bit per neuron (set for +1, clear for -1),
+# stored little-endian in rows of uint64 words
+if hasattr(np, 'bitwise_count'):
+    def popcount(words):
+        return np.bitwise_count(words)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        words = np.ascontiguousarray(words)
+        counts = _POPCOUNT_TABLE[words.view(np.uint8)]
+        return counts.reshape(words.shape + (8,)).sum(-1)
+
+
+def pack(state):
+    bits = np.asarray(state) > 0
+    pad = -bits.shape[-1] % 64
+    if pad:
+        bits = np.concatenate([bits, np.zeros(bits.shape[:-1] + (pad,), dtype=bool)], axis=-1)
+    return np.packbits(bits, axis=-1, bitorder='little').view('<u8')
+
+
+def unpack(words, n_neurons):
+    words = np.ascontiguousarray(words, dtype='<u8')
+    return np.unpackbits(words.view(np.uint8), axis=-1, count=n_neurons, bitorder='little')
+
+
 ###############################################
 class hopfield:
-    def __init__(self, input_shape):
+    def __init__(self, input_shape, storage='dense'):
         self.train_data = []
-        self.W = np.zeros([input_shape[0]*input_shape[1],input_shape[0]*input_shape[1]],dtype=np.int8)
+        self.storage = storage
+        self.n_neurons = input_shape[0]*input_shape[1]
+        if storage == 'dense':
+            self.W = np.zeros([self.n_neurons,self.n_neurons],dtype=np.int8)
+        elif storage == 'packed':
+            # W is never built: local fields come from the stored patterns,
+            # h = sum_p x_p (x_p.s) - P*s, with x_p.s = N - 2*popcount(x_p XOR s)
+            self.W = None
+            self.patterns = np.zeros([0,(self.n_neurons+63)//64],dtype='<u8')
+        elif storage == 'lowrank':
+            # W = X^T X - P*I is rank P, so only the P x N pattern matrix X is kept
+            # and W.s is computed as X^T (X.s) - P*s; see materialize() for a dense W
+            self.W = None
+            self.patterns = np.zeros([0,self.n_neurons],dtype=np.int8)
+        else:
+            raise ValueError('storage must be "dense", "packed" or "lowrank", got %r' % (storage,))
         
     def addTrain(self,img_dir):
         
@@ -29,6 +72,14 @@ class hopfield:
         img = np.where(img < img_mean,-1,1)
         train_data = img.flatten()
         
+        #
+        if self.storage == 'packed':
+            self.patterns = np.vstack([self.patterns, pack(train_data)])
+            return
+        elif self.storage == 'lowrank':
+            self.patterns = np.vstack([self.patterns, train_data.astype(np.int8)])
+            return
+
         #
         if True:
             self.W = self.W + np.outer(train_data,train_data) # change the weights to reflect the correlation between pixels
@@ -48,34 +99,115 @@ class hopfield:
                         self.W[i][j] += w_ij
                         self.W[j][i] += w_ij
                 
+    #
+    def field(self,state):
+        # W.state for any storage mode
+        if self.storage == 'lowrank':
+            return np.matmul(np.matmul(self.patterns,state),self.patterns) - self.patterns.shape[0]*state
+        if self.storage == 'packed':
+            # x_p.state = 2*bits_p.state - sum(state), one block of neurons at a time
+            state = np.asarray(state, dtype=np.int64)
+            m = np.zeros(self.patterns.shape[0], dtype=np.int64)
+            for start, stop, bits in self.pattern_blocks():
+                m += 2*np.matmul(bits, state[start:stop]) - state[start:stop].sum()
+            return self.fields_packed(m, state)
+        return np.matmul(self.W,state)
+
+    def row(self,idx):
+        # row idx of W as int64 (W is symmetric, so this is also column idx)
+        if self.storage == 'lowrank':
+            w = np.matmul(self.patterns[:,idx].astype(np.int64),self.patterns)
+            w[idx] = 0
+            return w
+        if self.storage == 'packed':
+            x = 2*((self.patterns[:,idx >> 6] >> np.uint64(idx & 63)) & np.uint64(1)).astype(np.int64) - 1
+            w = np.empty(self.n_neurons, dtype=np.int64)
+            for start, stop, bits in self.pattern_blocks():
+                w[start:stop] = 2*np.matmul(x, bits) - x.sum()
+            w[idx] = 0
+            return w
+        return self.W[idx].astype(np.int64)
+
+    #
+    def pattern_blocks(self, block=4096):
+        # the stored patterns' bits (P x block, uint8) for one block of neurons at a time,
+        # so packed storage is never expanded to a full P x N matrix
+        words = block // 64
+        for first in range(0, self.patterns.shape[1], words):
+            start = first*64
+            stop = min(start + block, self.n_neurons)
+            yield start, stop, unpack(self.patterns[:,first:first + words], stop - start)
+
+    def fields_packed(self, m, states):
+        # W.s = X^T (X.s) - P*s for X = 2*bits - 1, given the overlaps m = X.s;
+        # states is one state or a stack of them (one per row of m)
+        states = np.asarray(states, dtype=np.int64)
+        h = np.empty(states.shape, dtype=np.int64)
+        total = m.sum(-1, keepdims=True)
+        for start, stop, bits in self.pattern_blocks():
+            h[..., start:stop] = 2*np.matmul(m, bits) - total
+        h -= self.patterns.shape[0]*states
+        return h
+
+    def materialize(self):
+        # dense N x N weight matrix for any storage mode
+        if self.storage == 'dense':
+            return self.W
+        if self.storage == 'packed':
+            X = 2*unpack(self.patterns,self.n_neurons).astype(np.int32) - 1
+        else:
+            X = self.patterns.astype(np.int32)
+        W = np.matmul(X.T,X)
+        W[np.diag_indices(self.n_neurons)] = 0
+        return W
+
     #                
+    # Every recall path (predict, predict_no_plot, predict_packed, predict_batch, for all
+    # storage modes) uses the same rule on +/-1 states: s_i <- sign(h_i), and a neuron
+    # whose field h_i is 0 keeps its previous value. Recall stops when an iteration leaves
+    # the energy unchanged.
     def update(self,state,idx=None):
         if idx==None:
             # state = np.matmul(self.W,state)
             # state = np.where(state<0,-1,1)
-            new_state = np.matmul(self.W,state)
-            #new_state[new_state < 0] = -1
-            #new_state[new_state > 0] = 1
-            #new_state[new_state == 0] = state[new_state == 0]
-            state = new_state
+            h = self.field(state)
+            state = np.where(h > 0, 1, np.where(h < 0, -1, state))
         else:
             # state[idx] = np.matmul(self.W[idx],state)
             # state[idx] = np.where(state[idx] < 0,-1,1)
-            new_state = np.matmul(self.W[idx],state)
+            new_state = np.matmul(self.row(idx),state)
             if new_state < 0:
                 state[idx] = -1
             elif new_state > 0:
                 state[idx] = 1
         return state
 
+    #
+    def update_async(self, state, h, e, idxes, states=None):
+        # asynchronous sweep over idxes that keeps the local field h = W.state current:
+        # a flip of neuron idx adds one row of the symmetric, zero-diagonal W to h and
+        # changes the energy by -2*s_new*h[idx], so neurons that keep their sign cost O(1)
+        for idx in idxes:
+            if h[idx]*state[idx] < 0:
+                state[idx] = -state[idx]
+                e -= 2*state[idx]*h[idx]
+                h += 2*state[idx]*self.row(idx)
+            if states is not None:
+                states.append(state.copy())
+        return e
+
 
     #
     def predict_no_plot(self,
 						mat_input,
 						iteration,
 	                    asyn=False,
-                        async_iteration=200):
+                        async_iteration=200,
+                        keep_states=True):
         #
+        if self.storage == 'packed':
+            return self.predict_packed(mat_input, iteration, asyn, keep_states)
+
         input_shape = mat_input.shape
         mat_input = np.where(mat_input < 0.5,-1,1)
         e_list = []
@@ -88,16 +220,13 @@ class hopfield:
         states = [] # keep track of all updates
         if asyn:
             print('Starting asynchronous update with ',iteration,' iterations')
+            h = self.field(state)
             for i in range(iteration):
                 idxes = np.random.choice(np.arange(state.size), 
                                           state.size, replace=False)
                 #
-                for idx in tqdm(idxes):   
-                    state = self.update(state,idx)
-                    state_show = np.where(state < 1,0,1).reshape(input_shape)
-                    states.append(state.copy())
-
-                new_e = self.energy(state) #-0.5*np.matmul(np.matmul(state.T,self.W),state)
+                new_e = self.update_async(state, h, e, tqdm(idxes),
+                                          states if keep_states else None)
                 print('Iteration#',i,', Energy: ',new_e)
                 if new_e == e:
                     print('Energy remain unchanged, update will now stop.')
@@ -107,12 +236,12 @@ class hopfield:
         #
         else:
             print('Starting synchronous update with ',iteration,' iterations')
-            states = []
-            states.append(state.copy())
+            if keep_states:
+                states.append(state.copy())
             for i in range(iteration):
                 state = self.update(state)
-                state = np.where(state < 1, 0,1)
-                states.append(state.copy())
+                if keep_states:
+                    states.append(state.copy())
 
                 new_e = self.energy(state)
 
@@ -124,8 +253,168 @@ class hopfield:
                 e_list.append(e)
         print('Iteration completed, update will now stop.')
         
-
+        # states holds the flattened +/-1 state after every update (every neuron when
+        # asynchronous, every iteration when synchronous), or nothing without keep_states
         return np.where(state < 1,0,1).reshape(input_shape),e_list, states
+
+
+    #
+    def overlaps(self, words):
+        # x_p.s for every stored pattern; works on a single packed state or a stack of them
+        diff = np.bitwise_xor(words[..., None, :], self.patterns)
+        return self.n_neurons - 2*popcount(diff).sum(-1, dtype=np.int64)
+
+    def energy_packed(self, words):
+        # -0.5*s.W.s = -0.5*(sum_p (x_p.s)^2 - P*N) for the zero-diagonal Hebbian W
+        m = self.overlaps(words)
+        return -0.5*(np.sum(m*m, axis=-1) - self.patterns.shape[0]*self.n_neurons)
+
+    #
+    def predict_packed(self,
+                       mat_input,
+                       iteration,
+                       asyn=False,
+                       keep_states=True):
+        # same loop and update rule as predict_no_plot, but the state stays a packed bitset
+        # throughout; states are unpacked to +/-1 vectors only when keep_states is set
+        input_shape = mat_input.shape
+        n_patterns = self.patterns.shape[0]
+        state = pack(np.where(mat_input < 0.5,-1,1).flatten())
+        e_list = []
+
+        e = self.energy_packed(state)
+        e_list.append(e)
+
+        #
+        states = []
+        if asyn:
+            print('Starting asynchronous update with ',iteration,' iterations')
+            m = self.overlaps(state)
+            for i in range(iteration):
+                idxes = np.random.choice(np.arange(self.n_neurons), 
+                                          self.n_neurons, replace=False)
+                #
+                for idx in tqdm(idxes):
+                    word, bit = idx >> 6, np.uint64(idx & 63)
+                    x = 2*((self.patterns[:,word] >> bit) & np.uint64(1)).astype(np.int64) - 1
+                    s_old = 1 if (state[word] >> bit) & np.uint64(1) else -1
+                    h = np.dot(x, m) - n_patterns*s_old
+                    if h*s_old < 0:
+                        state[word] ^= np.uint64(1) << bit
+                        m -= 2*s_old*x
+                    if keep_states:
+                        states.append(2*unpack(state, self.n_neurons).astype(int) - 1)
+
+                new_e = -0.5*(np.dot(m, m) - n_patterns*self.n_neurons)
+                print('Iteration#',i,', Energy: ',new_e)
+                if new_e == e:
+                    print('Energy remain unchanged, update will now stop.')
+                    break
+                e = new_e
+                e_list.append(e)
+        #
+        else:
+            print('Starting synchronous update with ',iteration,' iterations')
+            if keep_states:
+                states.append(2*unpack(state, self.n_neurons).astype(int) - 1)
+            for i in range(iteration):
+                m = self.overlaps(state)
+                bits = unpack(state, self.n_neurons)
+                h = self.fields_packed(m, 2*bits.astype(np.int64) - 1)
+                state = pack((h > 0) | ((h == 0) & (bits == 1)))
+                if keep_states:
+                    states.append(2*unpack(state, self.n_neurons).astype(int) - 1)
+
+                new_e = self.energy_packed(state)
+
+                print('Iteration#',i,', Energy: ',new_e)
+                if new_e == e:
+                    print('Energy remain unchanged, update will now stop.')
+                    break
+                e = new_e
+                e_list.append(e)
+        print('Iteration completed, update will now stop.')
+
+
+        return unpack(state, self.n_neurons).astype(int).reshape(input_shape),e_list, states
+
+
+    #
+    def fields_batch(self, states, basis):
+        # local fields (int64) and energies (float64, exact) for a stack of +/-1 states,
+        # one state per row; basis is W as floats, the +/-1 patterns as floats in lowrank
+        # storage and unused in packed storage. The float products are exact integers
+        # (see batch_basis), so they are converted back to int64 before the energies are summed.
+        states = states.astype(np.int64)
+        if self.storage == 'packed':
+            m = self.overlaps(pack(states))
+            n_patterns = self.patterns.shape[0]
+            fields = self.fields_packed(m, states)
+        elif self.storage == 'lowrank':
+            m = np.matmul(states, basis.T)
+            n_patterns = basis.shape[0]
+            fields = np.matmul(m, basis).astype(np.int64) - n_patterns*states
+            m = m.astype(np.int64)
+        else:
+            fields = np.matmul(states, basis).astype(np.int64)
+            return fields, -0.5*np.sum(states*fields, axis=1)
+        return fields, -0.5*(np.sum(m*m, axis=1) - n_patterns*self.n_neurons)
+
+    def batch_basis(self):
+        # the matrix predict_batch multiplies by, in the narrowest float type in which every
+        # product is exact: float32 while all fields and overlaps stay below 2**24 in
+        # magnitude, float64 (exact below 2**53) otherwise
+        if self.storage == 'packed':
+            return None
+        if self.storage == 'lowrank':
+            matrix, bound = self.patterns, self.patterns.shape[0]*self.n_neurons
+        else:
+            matrix, bound = self.W, int(np.abs(self.W).max(initial=0))*self.n_neurons
+        return matrix.astype(np.float32 if bound < 2**24 else np.float64)
+
+    #
+    def predict_batch(self,
+                      mat_inputs,
+                      iteration):
+        # synchronous recall of an (N, H, W) stack of cues: every iteration is one
+        # matrix-matrix product over the cues that are still changing. Each cue follows
+        # exactly the steps of predict_no_plot(cue, iteration): the same update rule, and it
+        # stops once an update leaves its energy unchanged (or its state is a fixed point).
+        # Returns the final 0/1 states, each cue's energy trace (as e_list in predict_no_plot)
+        # and the number of updates that changed it.
+        n_cues = mat_inputs.shape[0]
+        input_shape = mat_inputs.shape[1:]
+        states = np.where(mat_inputs < 0.5,-1,1).reshape(n_cues,-1).astype(np.int8)
+
+        #
+        basis = self.batch_basis()
+        fields, energies = self.fields_batch(states, basis)
+        e_lists = [[e] for e in energies]
+        n_iterations = np.zeros(n_cues, dtype=int)
+        active = np.arange(n_cues)
+
+        #
+        for i in range(iteration):
+            if active.size == 0:
+                break
+            old = states[active]
+            h = fields[active]
+            new = np.where(h > 0, 1, np.where(h < 0, -1, old)).astype(np.int8)
+            changed = np.any(new != old, axis=1)
+            active = active[changed]
+            if active.size == 0:
+                break
+            states[active] = new[changed]
+            n_iterations[active] += 1
+            fields[active], energies = self.fields_batch(states[active], basis)
+            moved = np.array([e != e_lists[k][-1] for k, e in zip(active, energies)], dtype=bool)
+            for k, e in zip(active[moved], energies[moved]):
+                e_lists[k].append(e)
+            active = active[moved]
+
+        #
+        outputs = np.where(states < 1,0,1).reshape((n_cues,) + input_shape)
+        return outputs, [np.array(e) for e in e_lists], n_iterations
         
         
     #
@@ -167,7 +456,7 @@ class hopfield:
                     axs[0].set_title('Async update Iteration #%i' %i)
                     fig.canvas.draw_idle()
                     #plt.pause(0.01)
-                new_e = -0.5*np.matmul(np.matmul(state.T,self.W),state)
+                new_e = self.energy(state)
                 print('Iteration#',i,', Energy: ',new_e)
                 if new_e == e:
                     print('Energy remain unchanged, update will now stop.')
@@ -181,9 +470,8 @@ class hopfield:
             states.append(state.copy())
             for i in range(iteration):
                 state = self.update(state)
-                state = np.where(state < 1, 0,1)
                 states.append(state.copy())
-                state_show = state.copy().reshape(input_shape)
+                state_show = np.where(state < 1,0,1).reshape(input_shape)
                 graph.set_data(state_show*255)
                 axs[0].set_title('Sync update Iteration #%i' %i)
                 fig.canvas.draw_idle()
@@ -209,5 +497,7 @@ class hopfield:
         return np.where(state < 1,0,1).reshape(input_shape),e_list, states
     
     def energy(self,o):
-        e = -0.5*np.matmul(np.matmul(o.T,self.W),o)
+        if self.storage == 'packed' and np.all(np.abs(o) == 1):
+            return self.energy_packed(pack(o))
+        e = -0.5*np.matmul(o.T,self.field(o))
         return e
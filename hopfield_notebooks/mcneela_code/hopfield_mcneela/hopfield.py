@@ -4,12 +4,12 @@ import random
 # %load ../../retina/mlearn/hopfield/visuals.py
 import time, warnings
 from retina.mlearn.hopfield.hopfield_network import *
+from retina.mlearn.hopfield.basins import map_basins
+from retina.mlearn.hopfield.rendering import ConnectionCollection, FrameRenderer
 from retina.core.axes import Fovea3D
 from matplotlib.pyplot import *
 from matplotlib import gridspec
 from matplotlib.widgets import Button
-from sklearn.decomposition import PCA
-from scipy.interpolate import griddata as gd
 
 
 ###########################################################
@@ -24,27 +24,42 @@ class HopfieldNetwork(object):
 
     c.f. https://en.wikipedia.org/wiki/Hopfield_Network
     """
-    def __init__(self, num_neurons, activation_fn=None):
+    def __init__(self, num_neurons, activation_fn=None, low_rank=False, threshold=0, max_steps=100):
         """
         Instantiates a Hopfield Network comprised of "num_neurons" neurons.
         
         num_neurons         The number of neurons in the network.
+        low_rank            Store the Hebbian weights in factored form (see LowRankWeights)
+                            instead of as a dense N x N matrix.
+        threshold           The threshold of the network's activation function.
+        max_steps           The default step budget per pattern for synchronous recall.
         _weights            The network's weight matrix.
         _trainers           A dictionary containing the methods available for 
                             training the network.
         _vec_activation     A vectorized version of the network's activation function.
         """
         self.num_neurons = num_neurons
-        self._weights = np.zeros((self.num_neurons, self.num_neurons), dtype=np.int_)
-        self._trainers = {"hebbian": self._hebbian, "storkey": self._storkey}
-        self._recall_modes= {"synchronous": self._synchronous, "asynchronous": self._asynchronous}
-        self._vec_activation = np.vectorize(self._activation)
-        self._train_act = np.vectorize(self._train_activation)
+        self.low_rank = low_rank
+        self.threshold = threshold
+        self.max_steps = max_steps
+        self.recall_status = None
+        self.recall_steps = None
+        self.reset()
+        self._trainers = {"hebbian": self._hebbian, "storkey": self._storkey,
+                          "projection": self._projection}
+        self._recall_modes= {"synchronous": self._synchronous, "asynchronous": self._asynchronous,
+                             "parallel": self._parallel}
+        self._vec_activation = self._activation
+        self._train_act = self._train_activation
 
     def weights(self):
         """
         Getter method for the network's weight matrix.
+
+        A low-rank network materializes its dense weight matrix on demand.
         """
+        if self.low_rank:
+            return self._weights.toarray()
         return self._weights
 
     def reset(self):
@@ -54,9 +69,13 @@ class HopfieldNetwork(object):
         Useful for retraining the network from scratch after an initial round
         of training has already been completed.
         """
-        self._weights = np.zeros((self.num_neurons, self.num_neurons), dtype=np.int_)
+        if self.low_rank:
+            self._weights = LowRankWeights(self.num_neurons)
+        else:
+            self._weights = np.zeros((self.num_neurons, self.num_neurons), dtype=np.int_)
+        self._hebbian_patterns = 0
 
-    def train(self, patterns, method="hebbian", threshold=0, inject = lambda x, y: None):
+    def train(self, patterns, method="hebbian", threshold=0, inject=None, **kwargs):
         """
         The wrapper method for the network's various training algorithms stored in
         self._trainers.
@@ -75,13 +94,18 @@ class HopfieldNetwork(object):
                         Look to self._trainers for a list of the available options.
         threshold       The threshold value for the network's activation function.
                         Defaults to 0.
+        inject          Optional callback inject(previous_weights, iteration) run after
+                        each pattern is learned.
+
+        Any further keyword arguments are passed on to the training method, e.g.
+        block_size for "storkey".
         """
         try:
-            return self._trainers[method](patterns, threshold, inject)
+            return self._trainers[method](patterns, threshold, inject, **kwargs)
         except KeyError:
             print(method + " is not a valid training method.")
 
-    def recall(self, patterns, steps=None, mode="asynchronous", inject = lambda x, y: None):
+    def recall(self, patterns, steps=None, mode="asynchronous", inject = lambda x, y: None, **kwargs):
         """
         Wrapper method for self._synchronous and self._asynchronous.
 
@@ -89,40 +113,116 @@ class HopfieldNetwork(object):
 
         patterns        The input vectors to recall. 
 
-        steps           Number of steps to compute. Defaults to None.
+        steps           Number of steps to compute. Defaults to None. In synchronous
+                        mode this is the step budget per pattern (self.max_steps when
+                        None), and recall_status / recall_steps record how each
+                        pattern finished (see converge()). In parallel mode it is
+                        the number of sweeps allowed per pattern.
+
+        Any further keyword arguments are passed on to the recall method, e.g.
+        workers and seed for "parallel".
 
         Given 'patterns', recall(patterns) classifies these patterns based on those
         which the network has already seen.
         """
         try:
-            return self._recall_modes[mode](patterns, steps, inject)
+            return self._recall_modes[mode](patterns, steps, inject, **kwargs)
         except KeyError:
             print(mode + " is not a valid recall mode.")
 
     def energy(self, state):
         """
         Returns the energy for any input to the network.
+
+        A matrix with one state per row returns the energy of each row.
+        """
+        state = np.asarray(state)
+        if state.ndim > 1:
+            return self.energies(state)
+        return -0.5 * np.dot(state, self._dot(state))
+
+    def energies(self, states):
+        """
+        Returns the energies -0.5 * s.W.s of an (M, N) matrix of states.
+
+        Computed as one (M, N) product with W followed by a row-wise dot
+        product, so no N x N temporaries are allocated.
+        """
+        states = np.atleast_2d(states)
+        return -0.5 * np.einsum('ij,ij->i', self._dot(states), states)
+
+    def _dot(self, states):
+        """
+        Returns states . W for either weight representation.
+        """
+        if self.low_rank:
+            return self._weights.dot(states)
+        return np.dot(states, self._weights)
+
+    def _weight_row(self, index):
+        """
+        Returns W[index, :] for either weight representation.
+        """
+        if self.low_rank:
+            return self._weights.row(index)
+        return self._weights[index, :]
+
+    def converge(self, patterns, max_steps=None, history=8, inject=None):
         """
-        return -0.5 * np.sum(np.multiply(np.outer(state, state), self._weights))
+        Synchronous recall that stops each pattern as soon as its outcome is known.
 
-    def _synchronous(self, patterns, steps=10):
+        Every step applies the activation function to all patterns that are still
+        running. The last `history` states of each pattern are kept in a table
+        keyed by their packed bits, so a pattern stops when its new state repeats
+        the previous one (a fixed point) or an earlier one (a limit cycle, of
+        period two for symmetric weights). Patterns still changing after max_steps
+        steps (self.max_steps when None) time out.
+
+        Returns (states, status, steps): the final states, one of "converged",
+        "cycled" or "timeout" per pattern, and the number of steps each pattern ran.
+        """
+        if max_steps is None:
+            max_steps = self.max_steps
+        states = np.array(patterns, ndmin=2)
+        status = np.full(len(states), "timeout", dtype="<U9")
+        steps = np.zeros(len(states), dtype=np.int_)
+        seen = [{np.packbits(state > 0).tobytes(): 0} for state in states]
+        order = [list(table) for table in seen]
+        active = np.arange(len(states))
+        for step in range(1, max_steps + 1):
+            if len(active) == 0:
+                break
+            states[active] = self._activation(self._dot(states[active]), states[active])
+            steps[active] = step
+            if inject is not None:
+                inject(states, step)
+            running = []
+            for k in active:
+                key = np.packbits(states[k] > 0).tobytes()
+                if key in seen[k]:
+                    status[k] = "converged" if seen[k][key] == step - 1 else "cycled"
+                    continue
+                seen[k][key] = step
+                order[k].append(key)
+                if len(order[k]) > history:
+                    del seen[k][order[k].pop(0)]
+                running.append(k)
+            active = np.array(running, dtype=np.int_)
+        if np.ndim(patterns) == 1:
+            return states[0], status[0], steps[0]
+        return states, status, steps
+
+    def _synchronous(self, patterns, steps=None, inject=None):
         """
         Updates all network neurons simultaneously during each iteration of the
         recall process.
 
         Faster than asynchronous updating, but convergence of the recall method
-        is not guaranteed.
+        is not guaranteed: patterns can fall into two-state cycles. Each pattern
+        stops at a fixed point, a detected cycle or after `steps` steps.
         """
-        if steps:
-            for i in range(steps):
-                patterns = np.dot(patterns, self._weights)
-            return self._vec_activation(patterns)
-        else:
-            while True:
-                post_recall = self._vec_activation(np.dot(patterns, self._weights))
-                if np.array_equal(patterns, post_recall):
-                    return self._vec_activation(post_recall)
-                patterns = post_recall
+        states, self.recall_status, self.recall_steps = self.converge(patterns, steps, inject=inject)
+        return states
 
     def _asynchronous(self, patterns, steps=None, inject=lambda x:None):
         """
@@ -136,8 +236,9 @@ class HopfieldNetwork(object):
         if steps:
             for i in range(steps):
                 index = random.randrange(self.num_neurons)
-                patterns[:,index] = np.dot(self._weights[index,:], np.transpose(patterns))
-            return self._vec_activation(patterns)
+                fields = np.dot(patterns, self._weight_row(index))
+                patterns[:,index] = self._activation(fields, patterns[:,index])
+            return patterns
         else:
             post_recall = patterns.copy()
             inject(post_recall, 0)
@@ -146,52 +247,149 @@ class HopfieldNetwork(object):
             while True:
                 index = random.randrange(self.num_neurons)
                 indicies.add(index)
-                post_recall[:,index] = np.dot(self._weights[index,:], np.transpose(patterns))
-                post_recall = self._vec_activation(post_recall)
+                fields = np.dot(patterns, self._weight_row(index))
+                post_recall[:,index] = self._activation(fields, patterns[:,index])
                 inject(post_recall, i)
                 if np.array_equal(patterns, post_recall) and len(indicies) == self.num_neurons:
-                    return self._vec_activation(post_recall)
+                    return post_recall
                 patterns = post_recall.copy()
                 i += 1
 
-    def _activation(self, value, threshold=0):
+    def _parallel(self, patterns, steps=None, inject=None, workers=None, seed=0):
         """
-        The network's activation function.
+        Asynchronous recall with the patterns sharded across a process pool that
+        shares the weight matrix (see parallel_recall).
 
-        Defaults to the sign function.
+        Every sweep updates each neuron once in random order, and a pattern stops
+        after a sweep without changes or after `steps` sweeps (self.max_steps when
+        None). The inject callback is not called, as the work happens in other
+        processes. Low-rank networks materialize their dense weights first.
         """
-        if value < threshold:
-            return -1
-        return 1
+        if steps is None:
+            steps = self.max_steps
+        return parallel_recall(self.weights(), patterns, workers, seed, self.threshold, steps)
 
-    def _train_activation(self, value, threshold=0):
-        if value == threshold:
-            return value
-        elif value < threshold:
-            return -1
-        return 1
+    def _activation(self, values, previous=None):
+        """
+        The network's activation function, applied elementwise.
 
-    def _hebbian(self, patterns, threshold=0, inject= lambda x, y: None):
+        Defaults to the sign function around self.threshold. Values exactly at the
+        threshold keep their previous state when one is given.
+        """
+        return sign_activation(values, self.threshold, previous)
+
+    def _train_activation(self, values, threshold=0):
+        return train_activation(values, threshold)
+
+    def _hebbian(self, patterns, threshold=0, inject=None):
         """
         Implements Hebbian learning.
+
+        The weights are W = (X^T X - P*I) / P for all P patterns learned since the
+        last reset, so training in several calls gives the same weights as one
+        call with every pattern, for dense and low-rank networks alike.
+
+        Without an inject callback all patterns are added with a single matrix
+        product; low-rank networks only store the patterns. With a callback the
+        patterns are learned one at a time and inject receives the weights from
+        before each pattern (materialized as a dense matrix for low-rank networks).
         """
-        
-        # this just sums up the wight matrices for each pattern and the normalizes/removes diagonal
+        patterns = np.asarray(patterns)
+        if self.low_rank:
+            if inject is None:
+                self._weights.add(patterns)
+                return
+            i = 1
+            for pattern in patterns:
+                prev = self._weights.toarray()
+                self._weights.add(pattern[np.newaxis])
+                inject(prev, i)
+                i += 1
+            return
+
+        # sums up the weight matrices of the patterns on top of the un-normalized
+        # weights of earlier calls, then removes the diagonal and normalizes
+        stored = self._hebbian_patterns
+        weights = self._weights * stored if stored else self._weights
+        if inject is None:
+            weights = weights + np.dot(patterns.T, patterns)
+            np.fill_diagonal(weights, 0)
+            self._weights = weights / (stored + len(patterns))
+        else:
+            i = 1
+            for pattern in patterns:
+                prev = self._weights.copy()
+                weights = weights + np.outer(pattern, pattern)
+                np.fill_diagonal(weights, 0)
+                self._weights = weights / (stored + i)
+                inject(prev, i)
+                i += 1
+        self._hebbian_patterns = stored + len(patterns)
+
+    def _storkey(self, patterns, threshold=0, inject=None, block_size=1):
+        """
+        Implements Storkey learning.
+
+        Patterns are learned one at a time. The local fields h = W.x of each new
+        pattern x are computed once and reused for every h_ij term, which turns
+        the rule into the matrix update
+
+            W += (x x^T - x h^T - h x^T + 2W) / N        (zero diagonal)
+
+        With block_size > 1 each block of patterns is learned with one set of
+        matrix products, using the weights from the start of the block for all
+        of its patterns. This is faster but only approximates the sequential rule.
+        """
+        if self.low_rank:
+            print("Storkey learning needs a dense weight matrix; create the network with low_rank=False.")
+            return
+        patterns = np.asarray(patterns, dtype=float)
+        self._weights = self._weights.astype(float)
         i = 1
-        for pattern in patterns:
-            prev = self._weights.copy()
-            self._weights += np.outer(pattern, pattern)
-            inject(prev, i)
+        for start in range(0, len(patterns), block_size):
+            block = patterns[start:start + block_size]
+            prev = self._weights.copy() if inject is not None else None
+            fields = np.dot(block, self._weights)
+            outer = np.dot(block.T, block)
+            cross = np.dot(block.T, fields)
+            self._weights += (outer - cross - cross.T + 2 * len(block) * self._weights) / self.num_neurons
+            np.fill_diagonal(self._weights, 0)
+            if inject is not None:
+                inject(prev, i)
             i += 1
-        np.fill_diagonal(self._weights, 0)
-        self._weights = self._weights / len(patterns)
 
-    def _storkey(self, patterns):
+    def _projection(self, patterns, threshold=0, inject=None, tolerance=1e-10):
         """
-        Implements Storkey learning.
+        Implements the pseudo-inverse (projection) learning rule.
+
+        The weights are the orthogonal projection onto the span of the stored
+        patterns, W = X^+ X for the P x N pattern matrix X. Each pattern is
+        added with a rank-one (Greville) update: the part of the new pattern x
+        outside the current span, e = x - W x, gives
+
+            W += e e^T / (e^T e)
+
+        so new patterns can be stored online at O(N^2) each instead of
+        recomputing the pseudo-inverse over all patterns. Patterns already in
+        the span (e^T e <= tolerance * x^T x) leave W unchanged. The diagonal
+        is kept so that W remains a projection; train a fresh network (or call
+        reset()) before switching to this rule from another one.
         """
-        print ("Storkey learning not implemented...")
-        pass
+        if self.low_rank:
+            print("Projection learning needs a dense weight matrix; create the network with low_rank=False.")
+            return
+        patterns = np.asarray(patterns, dtype=float)
+        self._weights = self._weights.astype(float)
+        i = 1
+        for pattern in patterns:
+            residual = pattern - np.dot(self._weights, pattern)
+            norm = np.dot(residual, residual)
+            if norm > tolerance * np.dot(pattern, pattern):
+                prev = self._weights.copy() if inject is not None else None
+                self._weights += np.outer(residual, residual) / norm
+                if inject is not None:
+                    inject(prev, i)
+            i += 1
         
 
 ###########################################################
@@ -214,7 +412,6 @@ class VisualNeuron(object):
         self.r = r
         self.x = r * np.cos(theta)
         self.y = r * np.sin(theta)
-        self.connections = {}
 
     def __repr__(self):
         """
@@ -229,29 +426,6 @@ class VisualNeuron(object):
         self.body = Circle((self.x, self.y), radius=neuron_radius, fill=False)
         axes.add_patch(self.body)
 
-    def draw_connection(self, neuron, connection_color, axes):
-        """
-        Draws a connection between two neurons.
-
-        neuron              the terminal neuron of the connection
-        connection_color    the color of the connection line to be drawn
-        axes                the Matplotlib axes to which the connection should be drawn
-        """
-        connection = Line2D((self.x, neuron.x), (self.y, neuron.y), color=connection_color)
-        self.connections.update({ neuron :  connection })
-        neuron.connections.update({ self : connection })
-        axes.add_line(self.connections[neuron])
-
-    def delete_connection(self, neuron):
-        """
-        Delete the connection between self and neuron. The connection will no longer
-        be drawn in the network diagram and will be cleared from memory.
-
-        neuron      the terminal neuron of the connection
-        """
-        network_lines = self.main_network.lines
-        del network_lines[network_lines.index(self.connections[neuron])]
-
 ###########################################################
 ###########################################################
 ###########################################################
@@ -265,17 +439,28 @@ class VisualHopfield(HopfieldNetwork):
         self.neurons = [VisualNeuron(i * d_theta, num_neurons) for i in range(num_neurons)]
         self.cs_plot = None
 
-    def run_visualization(self, training_data, recall_data=None):
+    def run_visualization(self, training_data, recall_data=None, output=None, fps=30, dpi=100):
         """
         Runs the Hopfield Network visualization. Trains the network on training_data and
         recalls on recall_data.
+
+        output      Optional .gif or video file (e.g. .mp4, written with ffmpeg). When given,
+                    the visualization runs headless on the Agg backend and every drawn frame
+                    is written to this file instead of being shown.
+        fps         The target frame rate. Updates arriving faster than this are applied to
+                    the figure but not drawn; None draws every update.
+        dpi         The resolution of the recorded frames.
         """
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            ion()
+            if output is None:
+                ion()
+            else:
+                switch_backend("agg")
             self.training_data = training_data
             self.recall_data = recall_data
             self._setup_display()
+            self.frames = FrameRenderer(self.network_fig, fps=fps, output=output, dpi=dpi)
             self._draw_network()
             self._plot_state([-1 for i in range(self.num_neurons)])
             self._plot_weights()
@@ -288,8 +473,11 @@ class VisualHopfield(HopfieldNetwork):
             self._set_mode("Learning")
             for state in recall_data:
                 self.recall([state], inject=self._recall_inject)
+                self.frames.draw(force=True)
             print("Finished.")
             self._set_mode("Finished")
+            self.frames.draw(force=True)
+            self.frames.close()
 
     def _train_inject(self, prev_weights, iteration, delay=.01):
         """
@@ -300,22 +488,14 @@ class VisualHopfield(HopfieldNetwork):
         iteration           The current iteration count
         delay               The time delay between each iteration. Larger delays
                             slow the rate of visualization and vice versa.
+
+        Connections whose displayed weight changed since the previous update are
+        highlighted. The figure is only redrawn at the renderer's target frame rate.
         """
-        self.cmap.set_data(self._weights)
+        self.cmap.set_data(self.weights())
         self._update_iter(iteration)
-        new_weights = self._train_act(self.weights())
-        colors = ['green', 'blue', 'red']
-        for ((row, column), value) in np.ndenumerate(new_weights):
-            if self.neurons[row] is self.neurons[column]:
-                continue
-            elif new_weights[row,column] != prev_weights[row,column]:
-                connection = self.neurons[row].connections[self.neurons[column]]
-                setp(connection, linewidth='4')
-                setp(connection, color=colors[new_weights[row,column]])
-            else:
-                connection = self.neurons[row].connections[self.neurons[column]]
-                setp(connection, linewidth='1')
-        pause(delay)
+        self.connections.update(self._train_act(self.weights()))
+        self.frames.draw(delay)
 
     def _set_mode(self, mode):
         """
@@ -345,20 +525,20 @@ class VisualHopfield(HopfieldNetwork):
         state = np.array(state)
         self.state_plot.set_data(state.reshape(5, 5))
         currentenergy = self.energy(state)
-        current_state = self.pca.transform(state)
+        current_state = self.basins.project(state)
         if self.cs_plot:
             self.cs_plot.remove()
         self.cs_plot = self.energy_diagram.scatter(current_state[:,0], current_state[:,1], currentenergy,
                                                 s=80, c='b', marker='o')
         self._update_iter(iteration)
-        pause(delay)
+        self.frames.draw(delay)
 
     def _setup_display(self):
         """
         Sets up the Matplotlib figures and axes required for the visualization.
         """
         self.network_fig = figure(figsize=(20, 20))
-        self.network_fig.canvas.set_window_title("Hopfield Network Visualization")
+        self.network_fig.canvas.manager.set_window_title("Hopfield Network Visualization")
         gs = gridspec.GridSpec(2, 4)
         self.main_network = subplot(gs[:,:2])
         self.main_network.set_title("Network Diagram")
@@ -392,46 +572,29 @@ class VisualHopfield(HopfieldNetwork):
         """
         Draws the network diagram to the Matplotlib canvas.
         """
-        connections = set()
-        colors = ['green', 'blue', 'red']
-        for (index1, neuron) in enumerate(self.neurons):
+        for neuron in self.neurons:
             neuron.draw(self.main_network)
-            connections.add(neuron)
-            for (index2, neuron_two) in enumerate(self.neurons):
-                if neuron_two in connections:
-                    continue
-                else:
-                    connection_color = colors[int(self.weights()[index1, index2])]
-                    neuron.draw_connection(neuron_two, connection_color, self.main_network)
-            self.main_network.autoscale(tight=False)
+        self.connections = ConnectionCollection([neuron.x for neuron in self.neurons],
+                                                [neuron.y for neuron in self.neurons],
+                                                self.main_network)
+        self.connections.update(self._train_act(self.weights()))
+        self.main_network.autoscale(tight=False)
 
     def _plot_energy(self, num_samples=1000, path_length=20):
         """
         Plots the energy function of the network.
 
-        num_samples         The number of samples to be used in the computation of the energy function.
-                            The greater the number of samples, the higher the accuracy of the resultant plot.
-        path_length         The number of steps to compute in calculating each sample's path of convergence
-                            toward the network's attractors.
+        num_samples         The number of random states used to map the network's basins of attraction.
+                            The greater the number of samples, the more accurate the basin statistics.
+        path_length         The maximum number of steps each sample may take to converge toward the
+                            network's attractors.
+
+        The basin map is cached on disk under a hash of the weight matrix (see basins.py), so
+        re-plotting an unchanged network does not recompute it.
         """
         attractors = self.training_data
-        states = [[np.random.choice([-1, 1]) for i in range(self.num_neurons)] for j in range(num_samples)]
-        self.pca = PCA(n_components=2)
-        self.pca.fit(attractors)
-        paths = [attractors]
-        for i in range(path_length):
-            states = self.recall(states, steps=1)
-            paths.append(states)
-        x = y = np.linspace(-1, 1, 100)
-        X,Y = np.meshgrid(x, y)
-        meshpts = np.array([[x, y] for x, y in zip(np.ravel(X), np.ravel(Y))])
-        mesh = self.pca.inverse_transform(meshpts)
-        grid = np.vstack((mesh, np.vstack(paths)))
-        energies = np.array([self.energy(point) for point in grid])
-        grid = self.pca.transform(grid)
-        gmin, gmax = grid.min(), grid.max()
-        xi, yi = np.mgrid[gmin:gmax:100j, gmin:gmax:100j]
-        zi = gd(grid, energies, (xi, yi), method='nearest')
+        self.basins = map_basins(self, attractors, num_samples=num_samples, max_steps=path_length)
+        xi, yi, zi = self.basins.xi, self.basins.yi, self.basins.zi
         wireframe = self.energy_diagram.add_layer("wireframe")
         mesh_plot = self.energy_diagram.add_layer("mesh_plot")
         attracts = self.energy_diagram.add_layer("attractors")
@@ -441,8 +604,8 @@ class VisualHopfield(HopfieldNetwork):
                                         colors=(0.5, 0.5, 0.5, 0.5), alpha=0.2)
         self.energy_diagram.build_layer(mesh_plot.name, plot=self.energy_diagram.plot_surface, cmap=cm.coolwarm)
         self.contour_diagram.contour(xi, yi, zi)
-        grid = self.pca.transform(attractors)
-        z = np.array([self.energy(state) for state in attractors])
+        grid = self.basins.project(attractors)
+        z = self.energies(attractors)
         attracts.add_data(grid[:,0], grid[:,1], z)
         self.energy_diagram.build_layer("attractors", plot=self.energy_diagram.scatter, s=80, c='g', marker='o')
         wireframe.hide()
@@ -464,10 +627,9 @@ class VisualHopfield(HopfieldNetwork):
 
         To be called between the training and recall steps of the visualization.
         """
-        for neuron in self.neurons:
-            for line in neuron.connections.values():
-                if line.get_linewidth() != 1:
-                    setp(line, linewidth=1)
+        self.cmap.set_data(self.weights())
+        self.connections.update(self._train_act(self.weights()), highlight=False)
+        self.frames.draw(force=True)
 
     def _plot_state(self, state):
         """
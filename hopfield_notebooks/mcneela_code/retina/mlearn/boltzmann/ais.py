@@ -0,0 +1,100 @@
+import itertools
+from statistics import NormalDist
+import numpy as np
+from retina.mlearn.boltzmann.restricted_boltzmann_machine import sigmoid, softplus
+
+def logmeanexp(values):
+    """
+    Computes log(mean(exp(values))) without overflow.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    top = np.max(values)
+    return top + np.log(np.mean(np.exp(values - top)))
+
+def base_rate_bias(data, epsilon=1e-3):
+    """
+    Returns the visible biases of the base-rate model: the independent
+    Bernoulli model matching the mean of each visible unit over data.
+    """
+    means = np.clip(np.mean(data, axis=0), epsilon, 1 - epsilon)
+    return np.log(means) - np.log(1 - means)
+
+def _log_unnormalized(rbm, visible, inputs, beta, base_bias):
+    """
+    log p*_beta(v) of the intermediate model between the base-rate model
+    (beta = 0) and the RBM (beta = 1), given the RBM's hidden inputs W.v + c.
+    """
+    return (1 - beta) * np.dot(visible, base_bias) + beta * np.dot(visible, rbm.visible_bias) \
+        + np.sum(softplus(beta * inputs), axis=1)
+
+def annealed_importance_sampling(rbm, num_chains=100, betas=10000, data=None, confidence=0.95,
+                                 seed=None):
+    """
+    Estimates the log partition function log Z of an RBM with annealed
+    importance sampling (Salakhutdinov & Murray, 2008).
+
+    num_chains independent annealing runs are simulated together as one
+    (num_chains, visible) matrix. Each run starts from an exact sample of the
+    base-rate model, which has no weights and the visible biases fitted to
+    data (zero biases when data is None), and moves through the intermediate
+    models given by betas (a number of evenly spaced temperatures from 0 to 1,
+    or an increasing sequence ending at 1) with one Gibbs step per temperature.
+
+    Returns (log_z, lower, upper): the estimate and a confidence interval
+    from the standard error of the importance weights.
+    """
+    rng = np.random.RandomState(seed)
+    if np.isscalar(betas):
+        betas = np.linspace(0, 1, int(betas))
+    betas = np.asarray(betas, dtype=np.float64)
+    if data is None:
+        base_bias = np.zeros(rbm.num_visible)
+    else:
+        base_bias = base_rate_bias(data)
+    log_z_base = rbm.num_hidden * np.log(2) + np.sum(softplus(base_bias))
+    visible = (rng.random_sample((num_chains, rbm.num_visible)) < sigmoid(base_bias)).astype(np.float64)
+    log_weights = np.zeros(num_chains)
+    for previous, beta in zip(betas[:-1], betas[1:]):
+        inputs = np.dot(visible, rbm.weights.T) + rbm.hidden_bias
+        log_weights += _log_unnormalized(rbm, visible, inputs, beta, base_bias) \
+            - _log_unnormalized(rbm, visible, inputs, previous, base_bias)
+        hidden = (rng.random_sample(inputs.shape) < sigmoid(beta * inputs)).astype(np.float64)
+        visible_inputs = (1 - beta) * base_bias + beta * (np.dot(hidden, rbm.weights) + rbm.visible_bias)
+        visible = (rng.random_sample(visible.shape) < sigmoid(visible_inputs)).astype(np.float64)
+    return log_z_base + _confidence_interval(log_weights, confidence)
+
+def _confidence_interval(log_weights, confidence):
+    """
+    Returns log(mean(w)) and the bounds log(mean(w) -/+ z * sem(w)) of the
+    importance weights, computed relative to the largest weight. The lower
+    bound is -inf when the interval reaches zero.
+    """
+    top = np.max(log_weights)
+    weights = np.exp(log_weights - top)
+    mean = np.mean(weights)
+    error = NormalDist().inv_cdf(0.5 + confidence / 2) * np.std(weights) / np.sqrt(len(weights))
+    with np.errstate(divide="ignore"):
+        lower = np.log(max(mean - error, 0))
+    return np.array([top + np.log(mean), top + lower, top + np.log(mean + error)])
+
+def exact_log_partition(rbm):
+    """
+    Computes log Z exactly by enumerating every state of the smaller layer.
+    Only feasible for about 25 units or fewer in that layer; use it to check
+    AIS estimates on small models.
+    """
+    if rbm.num_hidden <= rbm.num_visible:
+        hidden = np.array(list(itertools.product([0, 1], repeat=rbm.num_hidden)), dtype=np.float64)
+        terms = np.dot(hidden, rbm.hidden_bias) \
+            + np.sum(softplus(np.dot(hidden, rbm.weights) + rbm.visible_bias), axis=1)
+    else:
+        visible = np.array(list(itertools.product([0, 1], repeat=rbm.num_visible)), dtype=np.float64)
+        terms = -rbm.free_energy(visible)
+    return logmeanexp(terms) + np.log(len(terms))
+
+def log_likelihood(rbm, data, log_z):
+    """
+    Returns the average log-likelihood of the rows of data given an estimate
+    of the RBM's log partition function.
+    """
+    return -np.mean(rbm.free_energy(np.asarray(data, dtype=np.float64))) - log_z
@@ -3,94 +3,133 @@ import numpy as np
 def sigmoid(x):
     return 1 / (1 + np.exp(-x))
 
+def softplus(x):
+    """
+    Computes log(1 + exp(x)) without overflow.
+    """
+    return np.logaddexp(0, x)
+
+def log_sigmoid(x):
+    """
+    Computes log(sigmoid(x)) without overflow.
+    """
+    return -np.logaddexp(0, -x)
+
 class RBM(object):
-    def __init__(self, num_visible, num_hidden, learning_rate=0.05):
+    def __init__(self, num_visible, num_hidden, learning_rate=0.05, seed=None):
         """
         Initializes a new Restricted Boltzmann Machine having
         num_visible neurons in the visible layer and num_hidden
         neurons in the hidden layer. By default, the learning
         rate is set to 0.05, but this can be altered to adjust
         the speed (and granularity) of training adjustments.
+        seed seeds the random number generator used for the
+        initial weights and for sampling.
+
+        All methods work on batches: a matrix of states has one
+        state per row.
         """
         self.num_visible = num_visible
         self.num_hidden = num_hidden
         self.learning_rate = learning_rate
+        self.rng = np.random.RandomState(seed)
+
+        # Small random weights break the symmetry between hidden units
+        self.weights = 0.01 * self.rng.randn(self.num_hidden, self.num_visible)
 
-        # Set the network's weight matrix to all zeros, initially
-        self.weights = np.zeros((self.num_hidden, self.num_visible))  
-        
         # Initialize the network's visible (binary) states
-        self.visible = np.zeros((self.num_visible, 1))
+        self.visible = np.zeros((1, self.num_visible))
 
         # Initialize the network's hidden (binary) states
-        self.hidden = np.zeros((self.num_hidden, 1))
+        self.hidden = np.zeros((1, self.num_hidden))
 
         # Bias weights for the visible layer
-        self.visible_bias = np.random.randn(self.num_visible)
+        self.visible_bias = np.zeros(self.num_visible)
 
         # Bias weights for the hidden layer
-        self.hidden_bias = np.random.randn(self.num_hidden, 1)
-        print(self.hidden_bias)
-        # Vectorize the network's activation function
-        self.vectorized_activation = np.vectorize(self.activation_fn)
+        self.hidden_bias = np.zeros(self.num_hidden)
 
-        # Vectorize the boolean activation function
-        self.vec_bool_activation = np.vectorize(self.bool_activation)
+        # Visible states of the persistent contrastive divergence chains
+        self.fantasy = None
 
-    def activation_fn(self, value):
-        if sigmoid(value) > 0.5:
-            return 1
-        return 0
+    def activation_fn(self, probabilities):
+        """
+        Deterministic activation: 1 where a unit's probability of
+        being on exceeds 0.5, 0 elsewhere.
+        """
+        return (np.asarray(probabilities) > 0.5).astype(np.float64)
 
-    def bool_activation(self, value):
-        if value is True:
-            return 1
-        return 0
+    def bool_activation(self, values):
+        """
+        Converts boolean states to 0/1 states.
+        """
+        return np.asarray(values, dtype=np.float64)
 
-    def energy(self):
+    def sample(self, probabilities):
         """
-        Returns the energy value associated with the network's current configuration.
+        Draws binary states with the given probabilities of each unit
+        being on, by comparing them with uniform random numbers.
         """
-        minus_E = np.dot(self.visible_bias.T, self.visible) \
-                + np.dot(self.hidden_bias.T, self.hidden) \
-                + np.dot(self.hidden.T, np.multiply(self.weights, self.visible))
+        return (self.rng.random_sample(np.shape(probabilities)) < probabilities).astype(np.float64)
+
+    def energy(self, visible=None, hidden=None):
+        """
+        Returns the energy
+
+            E(v, h) = -b.v - c.h - h.W.v
+
+        of each row of a (batch, visible) and a (batch, hidden) matrix of
+        states, by default the network's current configuration.
+        """
+        if visible is None:
+            visible = self.visible
+        if hidden is None:
+            hidden = self.hidden
+        visible, hidden = np.atleast_2d(visible), np.atleast_2d(hidden)
+        minus_E = np.dot(visible, self.visible_bias) \
+                + np.dot(hidden, self.hidden_bias) \
+                + np.einsum('ij,ij->i', np.dot(visible, self.weights.T), hidden)
         return -minus_E
 
+    def hidden_probabilities(self, visible):
+        """
+        Returns p(h_j = 1 | v) for a (batch, visible) matrix of states.
+        """
+        return sigmoid(np.dot(visible, self.weights.T) + self.hidden_bias)
+
+    def visible_probabilities(self, hidden):
+        """
+        Returns p(v_k = 1 | h) for a (batch, hidden) matrix of states.
+        """
+        return sigmoid(np.dot(hidden, self.weights) + self.visible_bias)
+
     def h_given_v(self):
         """
         Calculates and returns the total probability
 
             p(h | v)
-        
+
         and the individual probabilities
 
             p(h_i | v)
+
+        for each row of the internal visible layer.
         """
-        prob_product = 1
-        individual_probs = []
-        for j in range(self.num_hidden):
-            p_hj = sigmoid(self.hidden_bias[j] + np.dot(self.weights[j, :], self.visible))
-            individual_probs.append(p_hj)
-            prob_product *= p_hj
-        return prob_product, np.array(individual_probs)
+        return self.gen_h_given_v(self.visible)
 
     def v_given_h(self):
         """
         Calculates and returns the total probability
 
             p(v | h)
-        
+
         and the individual probabilities
 
             p(v_i | h)
+
+        for each row of the internal hidden layer.
         """
-        prob_product = 1
-        individual_probs = []
-        for k in range(self.num_visible):
-            p_vk = sigmoid(self.visible_bias[k] + np.dot(self.hidden.T, self.weights[:, k]))
-            individual_probs.append(p_vk)
-            prob_product *= p_vk
-        return prob_product, np.array(individual_probs)
+        return self.gen_v_given_h(self.hidden)
 
     def gen_v_given_h(self, hidden):
         """
@@ -99,13 +138,8 @@ class RBM(object):
         as an argument rather than generated from
         the internal hidden layer.
         """
-        prob_product = 1
-        individual_probs = []
-        for k in range(self.num_visible):
-            p_vk = sigmoid(self.visible_bias[k] + np.dot(hidden.T, self.weights[:, k]))
-            individual_probs.append(p_vk)
-            prob_product *= p_vk
-        return prob_product, np.array(individual_probs)
+        individual_probs = self.visible_probabilities(np.atleast_2d(hidden))
+        return np.prod(individual_probs, axis=1), individual_probs
 
     def gen_h_given_v(self, visible):
         """
@@ -114,86 +148,143 @@ class RBM(object):
         as an argument rather than generated from
         the internal visible layer.
         """
-        prob_product = 1
-        individual_probs = []
-        for j in range(self.num_hidden):
-            p_hj = sigmoid(self.hidden_bias[j] + np.dot(self.weights[j, :], visible))
-            individual_probs.append(p_hj)
-            prob_product *= p_hj
-        return prob_product, np.array(individual_probs)
-    
-    def free_energy(self):
-        """
-        Calculates the Gibbs Free Energy value
-        associated with the network's current
-        configuration.
-        """
-        energy_sum = 0
-        for j in range(self.num_hidden):
-            energy_sum += 1 + np.exp(self.hidden_bias[j] + 
-                                     np.dot(self.weights[j, :],
-                                            self.visible))
-        arg = np.dot(self.visible_bias.T, self.visible) + energy_sum
-        free_energy = np.exp(arg)
+        individual_probs = self.hidden_probabilities(np.atleast_2d(visible))
+        return np.prod(individual_probs, axis=1), individual_probs
+
+    def free_energy(self, visible=None, batch_size=65536):
+        """
+        Calculates the free energy
+
+            F(v) = -b.v - sum_j softplus(c_j + W_j.v)
+
+        of each row of a (batch, visible) matrix of states, by default the
+        network's current visible layer, so that p(v) = exp(-F(v)) / Z.
+        The sum over hidden units is taken in the log domain, which keeps
+        F finite for any weights. Rows are processed batch_size at a time
+        to bound memory on large datasets.
+        """
+        if visible is None:
+            visible = self.visible
+        visible = np.atleast_2d(visible)
+        free_energy = np.empty(len(visible))
+        for start in range(0, len(visible), batch_size):
+            chunk = visible[start:start + batch_size]
+            free_energy[start:start + batch_size] = -np.dot(chunk, self.visible_bias) \
+                - np.sum(softplus(np.dot(chunk, self.weights.T) + self.hidden_bias), axis=1)
         return free_energy
 
-    def train(self, training_set, error_threshold=.08, max_epochs=500):
+    def pseudo_log_likelihood(self, visible, exact=False, batch_size=65536):
+        """
+        Returns the pseudo-log-likelihood
+
+            sum_i log p(v_i | v_-i) = sum_i log sigmoid(F(v with v_i flipped) - F(v))
+
+        of each row of a (batch, visible) matrix of binary states.
+
+        By default each row flips one randomly chosen unit and scales the
+        term by num_visible, an unbiased estimate at the cost of one extra
+        free energy. With exact, every unit is flipped in turn, updating the
+        hidden pre-activations by one weight column per unit.
+        """
+        visible = np.atleast_2d(np.asarray(visible, dtype=np.float64))
+        result = np.empty(len(visible))
+        for start in range(0, len(visible), batch_size):
+            chunk = visible[start:start + batch_size]
+            inputs = np.dot(chunk, self.weights.T) + self.hidden_bias
+            hidden_term = np.sum(softplus(inputs), axis=1)
+            if exact:
+                units = range(self.num_visible)
+            else:
+                units = [self.rng.randint(self.num_visible, size=len(chunk))]
+            total = 0
+            for unit in units:
+                # Flipping v_i shifts the hidden inputs by +/- W[:, i]
+                sign = 1 - 2 * chunk[np.arange(len(chunk)), unit]
+                flipped = inputs + sign[:, None] * self.weights[:, unit].T
+                difference = hidden_term - np.sum(softplus(flipped), axis=1) - sign * self.visible_bias[unit]
+                total = total + log_sigmoid(difference)
+            if not exact:
+                total = total * self.num_visible
+            result[start:start + batch_size] = total
+        return result
+
+    def _fantasy_particles(self, batch_size):
+        """
+        Returns the first batch_size persistent chains, starting new chains
+        from random states when there are not enough of them.
+        """
+        if self.fantasy is None or len(self.fantasy) < batch_size:
+            self.fantasy = self.sample(np.full((batch_size, self.num_visible), 0.5))
+        return self.fantasy[:batch_size]
+
+    def contrastive_divergence(self, batch, k=1, persistent=False):
+        """
+        Performs one CD-k update of the weights and biases from a
+        (batch, visible) matrix of training vectors and returns the
+        squared reconstruction error summed over the batch.
+
+        The negative phase runs k steps of block Gibbs sampling, starting
+        from the hidden states sampled for the batch or, with persistent,
+        from the persistent chains left by the previous update (PCD).
+        """
+        positive_hidden = self.hidden_probabilities(batch)
+        hidden = self.sample(positive_hidden)
+        reconstruction = self.visible_probabilities(hidden)
+        if persistent:
+            hidden = self.sample(self.hidden_probabilities(self._fantasy_particles(len(batch))))
+        for step in range(k):
+            negative_visible = self.visible_probabilities(hidden)
+            visible = self.sample(negative_visible)
+            negative_hidden = self.hidden_probabilities(visible)
+            hidden = self.sample(negative_hidden)
+        if persistent:
+            self.fantasy[:len(batch)] = visible
+        rate = self.learning_rate / len(batch)
+        self.weights += rate * (np.dot(positive_hidden.T, batch) - np.dot(negative_hidden.T, negative_visible))
+        self.hidden_bias += rate * np.sum(positive_hidden - negative_hidden, axis=0)
+        self.visible_bias += rate * np.sum(batch - negative_visible, axis=0)
+        self.visible, self.hidden = visible, hidden
+        return np.sum((batch - reconstruction) ** 2)
+
+    def train(self, training_set, error_threshold=.08, max_epochs=500, batch_size=10, k=1,
+              persistent=False):
         """
         Trains the network on a list of training vectors passed
         as training_set. Converges either when the total sum squared
         error falls below the provided error_threshold or after
         max_epochs number of iterations of the contrastive divergence
         algorithm have been executed.
+
+        Each epoch visits the training vectors in a random order, in
+        mini-batches of batch_size, with k Gibbs steps per update (CD-k).
+        persistent selects persistent contrastive divergence (PCD). Returns
+        the total error of each epoch.
         """
+        training_set = np.asarray(training_set, dtype=np.float64)
+        errors = []
         for epoch in range(max_epochs):
+            order = self.rng.permutation(len(training_set))
             total_error = 0
-            for sample in training_set:
-                self.visible = np.array(sample).T
-                hidden_total_prob, hidden_individual_probs = self.h_given_v()
-                self.hidden = self.vectorized_activation(hidden_individual_probs)
-                positive_gradient = np.outer(self.hidden, self.visible)
-                visible_total_prob, visible_individual_probs = self.v_given_h()
-                self.visible = self.vectorized_activation(visible_individual_probs).T
-                negative_gradient = np.outer(self.hidden, self.visible)
-                self.weights += self.learning_rate * (positive_gradient - negative_gradient)
-                
-                sample_error = np.sum(sample - visible_individual_probs)
-                total_error += sample_error ** 2
-
-                self.hbias_arg = np.dot(sample, self.hidden_bias)[0]
-                hbias_probs = [sigmoid(self.hbias_arg) for i in range(self.num_hidden)]
-                self.hidden_bias = self.vec_bool_activation(hbias_probs > np.random.randn(self.num_hidden))
-                self.hidden_bias = self.hidden_bias.reshape((self.num_hidden, 1))
-
-                self.vbias_arg = np.dot(self.visible_bias, self.hidden_bias)[0]
-                vbias_probs = np.array([sigmoid(self.vbias_arg) for j in range(self.num_visible)])
-                self.visible_bias = self.vec_bool_activation(vbias_probs > np.random.randn(self.num_visible))
-                
+            for start in range(0, len(order), batch_size):
+                batch = training_set[order[start:start + batch_size]]
+                total_error += self.contrastive_divergence(batch, k, persistent)
+            errors.append(total_error)
             if total_error < error_threshold:
                 break
+        return errors
 
     def generate_visible(self, hidden_samples):
         """
         Assuming the network's been trained, given a list of hidden states,
         return the set of visible states generated by those layers.
         """
-        visible_states = []
-        for hidden_vec in hidden_samples:
-            hidden_vec = np.array(hidden_vec)
-            prob, visible_probs = self.gen_v_given_h(hidden_vec)
-            visible = self.vectorized_activation(visible_probs)
-            visible_states.append(visible)
-        return visible_states
+        prob, visible_probs = self.gen_v_given_h(np.asarray(hidden_samples, dtype=np.float64))
+        return self.activation_fn(visible_probs)
 
     def generate_hidden(self, visible_samples):
         """
         Assuming the network's been trained, given a list of visible states,
         return the set of hidden states generated by those layers.
         """
-        hidden_states = []
-        for visible_vec in visible_samples:
-            visible_vec = np.array(visible_vec)
-            prob, hidden_probs = self.gen_h_given_v(visible_vec)
-            hidden = self.vectorized_activation(hidden_probs)
-            hidden_states.append(hidden)
-        return hidden_states
+        prob, hidden_probs = self.gen_h_given_v(np.asarray(visible_samples, dtype=np.float64))
+        return self.activation_fn(hidden_probs)
@@ -0,0 +1,208 @@
+import os
+import hashlib
+import numpy as np
+from sklearn.decomposition import PCA
+from scipy.interpolate import griddata as gd
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "retina", "hopfield_basins")
+
+def weights_key(weights, *params):
+    """
+    Returns a hex digest identifying a weight matrix together with any extra
+    parameters (sampling settings, training patterns) that affect a basin map.
+    """
+    digest = hashlib.sha1()
+    weights = np.ascontiguousarray(weights, dtype=np.float64)
+    digest.update(str(weights.shape).encode())
+    digest.update(weights.tobytes())
+    for param in params:
+        if isinstance(param, np.ndarray):
+            digest.update(np.ascontiguousarray(param).tobytes())
+        else:
+            digest.update(repr(param).encode())
+    return digest.hexdigest()
+
+class BasinMap(object):
+    """
+    The basins of attraction of a trained HopfieldNetwork, estimated from
+    random initial states, together with the energy surface over the first
+    two principal axes of the training patterns.
+
+    attractors      (K, N) fixed points reached by at least one sample
+    sizes           (K,) number of samples that converged to each attractor
+    energies        (K,) energy of each attractor
+    mean_steps      (K,) average number of steps taken to reach each attractor
+    stored          (K,) index of the training pattern an attractor equals (or
+                    is the negation of), -1 for spurious states
+    reversed        (K,) True where an attractor is a negated training pattern
+    labels          (S,) attractor index of every sample, -1 for samples that
+                    cycled or timed out
+    status          (S,) convergence status of every sample
+    mean, components    the PCA projection onto the plotted plane
+    xi, yi, zi      the interpolated energy surface
+    """
+    fields = ("attractors", "sizes", "energies", "mean_steps", "stored", "reversed",
+              "labels", "status", "mean", "components", "xi", "yi", "zi")
+
+    def __init__(self, **arrays):
+        for name in self.fields:
+            setattr(self, name, np.asarray(arrays[name]))
+
+    @property
+    def num_samples(self):
+        return len(self.labels)
+
+    def fractions(self):
+        """
+        Returns the fraction of all samples falling in each basin.
+        """
+        return self.sizes / float(self.num_samples)
+
+    def project(self, states):
+        """
+        Projects states onto the two principal axes used for the energy surface.
+        """
+        return np.dot(np.atleast_2d(states) - self.mean, self.components.T)
+
+    def statistics(self):
+        """
+        Returns one dictionary per attractor, largest basin first, with its
+        basin size, basin fraction, energy, mean convergence time and the
+        training pattern it corresponds to.
+        """
+        fractions = self.fractions()
+        order = np.argsort(-self.sizes, kind="stable")
+        return [{"attractor": int(k), "size": int(self.sizes[k]), "fraction": float(fractions[k]),
+                 "energy": float(self.energies[k]), "mean_steps": float(self.mean_steps[k]),
+                 "stored": int(self.stored[k]), "reversed": bool(self.reversed[k])}
+                for k in order]
+
+    def summary(self):
+        """
+        Prints a table of basin statistics.
+        """
+        print("%6s %8s %9s %10s %7s %s" % ("basin", "size", "fraction", "energy", "steps", "state"))
+        for row in self.statistics():
+            if row["stored"] < 0:
+                state = "spurious"
+            else:
+                state = ("-" if row["reversed"] else "") + "pattern %d" % row["stored"]
+            print("%6d %8d %9.3f %10.3f %7.2f %s" % (row["attractor"], row["size"], row["fraction"],
+                                                     row["energy"], row["mean_steps"], state))
+        for status in ("cycled", "timeout"):
+            count = np.count_nonzero(self.status == status)
+            if count:
+                print("%d samples %s" % (count, status))
+
+    def save(self, path):
+        """
+        Writes the map to path as an .npz archive. The file is written under a
+        temporary name first so an interrupted save never leaves a partial cache.
+        """
+        temp = path + ".tmp.npz"
+        np.savez_compressed(temp, **{name: getattr(self, name) for name in self.fields})
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            return cls(**{name: archive[name] for name in cls.fields})
+
+def _assign(network, patterns, num_samples, batch_size, max_steps, seed):
+    """
+    Samples random states in batches, runs each batch to convergence and
+    groups the final states by the fixed point they reached.
+    """
+    rng = np.random.RandomState(seed)
+    table = {}
+    attractors = []
+    labels = np.full(num_samples, -1, dtype=np.int_)
+    status = np.empty(num_samples, dtype="<U9")
+    steps = np.zeros(num_samples, dtype=np.int_)
+    for start in range(0, num_samples, batch_size):
+        stop = min(start + batch_size, num_samples)
+        batch = rng.choice([-1, 1], size=(stop - start, network.num_neurons))
+        states, status[start:stop], steps[start:stop] = network.converge(batch, max_steps)
+        for k in np.flatnonzero(status[start:stop] == "converged"):
+            key = np.packbits(states[k] > 0).tobytes()
+            if key not in table:
+                table[key] = len(attractors)
+                attractors.append(states[k])
+            labels[start + k] = table[key]
+    attractors = np.array(attractors, dtype=np.float64).reshape(-1, network.num_neurons)
+    converged = labels >= 0
+    sizes = np.bincount(labels[converged], minlength=len(attractors))
+    total_steps = np.bincount(labels[converged], weights=steps[converged], minlength=len(attractors))
+    mean_steps = total_steps / np.maximum(sizes, 1)
+    overlaps = np.dot(attractors, patterns.T) / network.num_neurons
+    stored = np.full(len(attractors), -1, dtype=np.int_)
+    reversed_ = np.zeros(len(attractors), dtype=bool)
+    if overlaps.size:
+        best = np.argmax(np.abs(overlaps), axis=1)
+        best_overlap = overlaps[np.arange(len(attractors)), best]
+        match = np.isclose(np.abs(best_overlap), 1)
+        stored[match] = best[match]
+        reversed_[match] = best_overlap[match] < 0
+    return attractors, sizes, mean_steps, stored, reversed_, labels, status
+
+def _surface(network, patterns, points, resolution):
+    """
+    Evaluates the energy on a resolution x resolution mesh over the first two
+    principal axes of the patterns, plus the given points, and interpolates
+    the result onto a regular grid.
+    """
+    pca = PCA(n_components=2)
+    pca.fit(patterns)
+    x = y = np.linspace(-1, 1, resolution)
+    X, Y = np.meshgrid(x, y)
+    mesh = pca.inverse_transform(np.column_stack((X.ravel(), Y.ravel())))
+    grid = np.vstack((mesh, points))
+    energies = network.energies(grid)
+    grid = pca.transform(grid)
+    gmin, gmax = grid.min(), grid.max()
+    xi, yi = np.mgrid[gmin:gmax:resolution * 1j, gmin:gmax:resolution * 1j]
+    zi = gd(grid, energies, (xi, yi), method='nearest')
+    return pca.mean_, pca.components_, xi, yi, zi
+
+def map_basins(network, patterns, num_samples=1000, batch_size=256, max_steps=None,
+               resolution=100, seed=0, cache_dir=CACHE_DIR):
+    """
+    Maps the basins of attraction of a trained network.
+
+    num_samples random states are drawn in batches of batch_size and run to
+    convergence with the network's batched synchronous recall (at most
+    max_steps steps). Each converged sample is assigned to the fixed point it
+    reached, and every fixed point is matched against the training patterns.
+    The energy surface is evaluated over the PCA plane of the patterns at the
+    given resolution.
+
+    The resulting BasinMap is cached in cache_dir under a hash of the weight
+    matrix and all of the above settings, so mapping an unchanged network again
+    only reads the cache. Pass cache_dir=None to disable caching.
+    """
+    patterns = np.array(patterns, dtype=np.float64, ndmin=2)
+    if max_steps is None:
+        max_steps = network.max_steps
+    path = None
+    if cache_dir is not None:
+        key = weights_key(network.weights(), network.threshold, patterns,
+                          num_samples, batch_size, max_steps, resolution, seed)
+        path = os.path.join(cache_dir, key + ".npz")
+        if os.path.exists(path):
+            try:
+                return BasinMap.load(path)
+            except (IOError, ValueError, KeyError):
+                print("Ignoring unreadable basin cache " + path)
+    attractors, sizes, mean_steps, stored, reversed_, labels, status = \
+        _assign(network, patterns, num_samples, batch_size, max_steps, seed)
+    mean, components, xi, yi, zi = _surface(network, patterns, np.vstack((patterns, attractors)), resolution)
+    basins = BasinMap(attractors=attractors, sizes=sizes, energies=network.energies(attractors),
+                      mean_steps=mean_steps, stored=stored, reversed=reversed_, labels=labels,
+                      status=status, mean=mean, components=components, xi=xi, yi=yi, zi=zi)
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            basins.save(path)
+        except OSError as error:
+            print("Could not write basin cache: " + str(error))
+    return basins
@@ -0,0 +1,80 @@
+import time
+import random
+import numpy as np
+from retina.mlearn.hopfield.hopfield_network import HopfieldNetwork
+
+def legacy_activation(value, threshold=0):
+    """
+    The scalar activation that HopfieldNetwork used to wrap in np.vectorize.
+    """
+    if value < threshold:
+        return -1
+    return 1
+
+legacy_vec_activation = np.vectorize(legacy_activation)
+
+def legacy_synchronous(network, patterns, steps):
+    """
+    Synchronous recall applying the np.vectorize activation to the whole
+    pattern matrix after every step.
+    """
+    for i in range(steps):
+        patterns = legacy_vec_activation(network._dot(patterns))
+    return patterns
+
+def legacy_asynchronous(network, patterns, steps):
+    """
+    Asynchronous recall re-applying the np.vectorize activation to the whole
+    pattern matrix after every single-neuron update.
+    """
+    patterns = np.array(patterns)
+    for i in range(steps):
+        index = random.randrange(network.num_neurons)
+        patterns[:,index] = np.dot(patterns, network._weight_row(index))
+        patterns = legacy_vec_activation(patterns)
+    return patterns
+
+def best_time(fn, repeats=3):
+    """
+    Returns the fastest of several wall-clock timings of fn().
+    """
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run(sizes=(25, 1024, 4096), num_cues=16, sync_steps=5, async_steps=200, noise=0.1, seed=0):
+    """
+    Times the legacy loops against network.recall on Hebbian networks of each
+    size in sizes and prints the speedups. Returns a list of result dictionaries.
+
+    Synchronous recall stops each cue once its outcome is known, so the legacy
+    loop is run for as many steps as network.recall actually took.
+    """
+    rng = np.random.RandomState(seed)
+    results = []
+    print("%8s %6s %6s %12s %12s %8s" % ("neurons", "mode", "steps", "legacy (s)", "recall (s)", "speedup"))
+    for num_neurons in sizes:
+        num_patterns = max(3, num_neurons // 100)
+        patterns = rng.choice([-1, 1], size=(num_patterns, num_neurons))
+        network = HopfieldNetwork(num_neurons)
+        network.train(patterns)
+        cues = patterns[rng.randint(num_patterns, size=num_cues)]
+        cues = np.where(rng.rand(*cues.shape) < noise, -cues, cues)
+        modes = [("sync", "synchronous", legacy_synchronous, sync_steps),
+                 ("async", "asynchronous", legacy_asynchronous, async_steps)]
+        for mode, recall_mode, legacy, steps in modes:
+            recall_time = best_time(lambda: network.recall(cues, steps, mode=recall_mode))
+            if recall_mode == "synchronous":
+                steps = int(network.recall_steps.max())
+            legacy_time = best_time(lambda: legacy(network, cues, steps))
+            print("%8d %6s %6d %12.4f %12.4f %7.1fx" % (num_neurons, mode, steps, legacy_time, recall_time,
+                                                       legacy_time / recall_time))
+            results.append({"neurons": num_neurons, "mode": mode, "steps": steps,
+                            "legacy": legacy_time, "recall": recall_time})
+    return results
+
+if __name__ == "__main__":
+    run()
@@ -1,5 +1,161 @@
 import numpy as np
 import random
+import multiprocessing
+from multiprocessing import shared_memory
+
+def sign_activation(values, threshold=0, previous=None):
+    """
+    Vectorized bipolar activation used by HopfieldNetwork.
+
+    Values below threshold map to -1 and values above it to 1. Values exactly at
+    the threshold keep the matching entry of previous, or map to 1 when no
+    previous state is given.
+    """
+    states = np.sign(np.subtract(values, threshold)).astype(np.int_)
+    ties = states == 0
+    if previous is None:
+        states[ties] = 1
+    else:
+        np.copyto(states, previous, casting='unsafe', where=ties)
+    return states
+
+def train_activation(values, threshold=0):
+    """
+    Vectorized three-level activation used to display weights: -1 below
+    threshold, 1 above it and the threshold itself where they are equal.
+    """
+    states = np.sign(np.subtract(values, threshold)).astype(np.int_)
+    if threshold:
+        states[states == 0] = threshold
+    return states
+
+def asynchronous_sweeps(weights, patterns, rng, threshold=0, max_sweeps=100):
+    """
+    Asynchronous recall in sweeps. Each sweep visits every neuron once, in an
+    order drawn from rng, updating that neuron in all patterns at once. A pattern
+    is finished after a sweep in which none of its neurons changed.
+    """
+    states = np.array(patterns, ndmin=2)
+    active = np.arange(len(states))
+    for sweep in range(max_sweeps):
+        if len(active) == 0:
+            break
+        current = states[active]
+        changed = np.zeros(len(active), dtype=bool)
+        for index in rng.permutation(weights.shape[0]):
+            update = sign_activation(np.dot(current, weights[index]), threshold, current[:, index])
+            changed |= update != current[:, index]
+            current[:, index] = update
+        states[active] = current
+        active = active[changed]
+    return states
+
+_shared_block = None
+_shared_weights = None
+
+def _attach_weights(name, shape, dtype):
+    """
+    Pool initializer: maps the shared weight matrix into the worker process.
+    """
+    global _shared_block, _shared_weights
+    _shared_block = shared_memory.SharedMemory(name=name)
+    _shared_weights = np.ndarray(shape, dtype=dtype, buffer=_shared_block.buf)
+
+def _recall_shard(args):
+    """
+    Runs asynchronous_sweeps on one shard against the shared weights.
+    """
+    patterns, seed, threshold, max_sweeps = args
+    return asynchronous_sweeps(_shared_weights, patterns, np.random.default_rng(seed),
+                               threshold, max_sweeps)
+
+def parallel_recall(weights, patterns, workers=None, seed=0, threshold=0, max_sweeps=100):
+    """
+    Asynchronous recall of a batch of patterns sharded across a process pool.
+
+    The weight matrix is copied once into shared memory and mapped by every
+    worker rather than pickled per task. Shard k is recalled with a generator
+    seeded from the k-th child of np.random.SeedSequence(seed), so results are
+    reproducible for a given seed and number of workers.
+    """
+    patterns = np.array(patterns, ndmin=2)
+    if len(patterns) == 0:
+        return patterns
+    weights = np.ascontiguousarray(weights)
+    workers = min(workers or multiprocessing.cpu_count(), len(patterns))
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    shards = np.array_split(patterns, workers)
+    if workers == 1:
+        return asynchronous_sweeps(weights, patterns, np.random.default_rng(seeds[0]),
+                                   threshold, max_sweeps)
+    block = shared_memory.SharedMemory(create=True, size=weights.nbytes)
+    try:
+        np.ndarray(weights.shape, dtype=weights.dtype, buffer=block.buf)[:] = weights
+        pool = multiprocessing.Pool(workers, initializer=_attach_weights,
+                                    initargs=(block.name, weights.shape, weights.dtype.str))
+        try:
+            tasks = [(shard, seed, threshold, max_sweeps) for shard, seed in zip(shards, seeds)]
+            results = pool.map(_recall_shard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        block.close()
+        block.unlink()
+    return np.vstack(results)
+
+class LowRankWeights(object):
+    """
+    Hebbian weight matrix kept in factored form.
+
+    For P stored bipolar patterns X (a P x N matrix), the Hebbian weights
+    W = (X^T X - P*I) / P have rank P, so only X is stored and products with W
+    are computed as (X^T (X s) - P*s) / P. Memory is O(P*N) instead of O(N^2).
+    """
+    def __init__(self, num_neurons):
+        """
+        patterns        The P x N matrix of stored patterns.
+        """
+        self.num_neurons = num_neurons
+        self.patterns = np.zeros((0, num_neurons))
+        self.shape = (num_neurons, num_neurons)
+
+    def add(self, patterns):
+        """
+        Stores additional bipolar patterns.
+        """
+        self.patterns = np.vstack((self.patterns, np.asarray(patterns, dtype=float)))
+
+    def dot(self, states):
+        """
+        Returns states . W for a single state or a matrix with one state per row.
+        """
+        states = np.asarray(states, dtype=float)
+        num_patterns = len(self.patterns)
+        if num_patterns == 0:
+            return np.zeros_like(states)
+        fields = np.dot(np.dot(states, self.patterns.T), self.patterns) - num_patterns * states
+        return fields / num_patterns
+
+    def row(self, index):
+        """
+        Returns W[index, :] without building W.
+        """
+        num_patterns = len(self.patterns)
+        if num_patterns == 0:
+            return np.zeros(self.num_neurons)
+        row = np.dot(self.patterns[:, index], self.patterns) / num_patterns
+        row[index] = 0
+        return row
+
+    def toarray(self):
+        """
+        Materializes the dense N x N weight matrix.
+        """
+        num_patterns = len(self.patterns)
+        weights = np.dot(self.patterns.T, self.patterns)
+        np.fill_diagonal(weights, 0)
+        return weights / max(num_patterns, 1)
 
 class HopfieldNetwork(object):
     """
@@ -10,27 +166,42 @@ class HopfieldNetwork(object):
 
     c.f. https://en.wikipedia.org/wiki/Hopfield_Network
     """
-    def __init__(self, num_neurons, activation_fn=None):
+    def __init__(self, num_neurons, activation_fn=None, low_rank=False, threshold=0, max_steps=100):
         """
         Instantiates a Hopfield Network comprised of "num_neurons" neurons.
         
         num_neurons         The number of neurons in the network.
+        low_rank            Store the Hebbian weights in factored form (see LowRankWeights)
+                            instead of as a dense N x N matrix.
+        threshold           The threshold of the network's activation function.
+        max_steps           The default step budget per pattern for synchronous recall.
         _weights            The network's weight matrix.
         _trainers           A dictionary containing the methods available for 
                             training the network.
         _vec_activation     A vectorized version of the network's activation function.
         """
         self.num_neurons = num_neurons
-        self._weights = np.zeros((self.num_neurons, self.num_neurons), dtype=np.int_)
-        self._trainers = {"hebbian": self._hebbian, "storkey": self._storkey}
-        self._recall_modes= {"synchronous": self._synchronous, "asynchronous": self._asynchronous}
-        self._vec_activation = np.vectorize(self._activation)
-        self._train_act = np.vectorize(self._train_activation)
+        self.low_rank = low_rank
+        self.threshold = threshold
+        self.max_steps = max_steps
+        self.recall_status = None
+        self.recall_steps = None
+        self.reset()
+        self._trainers = {"hebbian": self._hebbian, "storkey": self._storkey,
+                          "projection": self._projection}
+        self._recall_modes= {"synchronous": self._synchronous, "asynchronous": self._asynchronous,
+                             "parallel": self._parallel}
+        self._vec_activation = self._activation
+        self._train_act = self._train_activation
 
     def weights(self):
         """
         Getter method for the network's weight matrix.
+
+        A low-rank network materializes its dense weight matrix on demand.
         """
+        if self.low_rank:
+            return self._weights.toarray()
         return self._weights
 
     def reset(self):
@@ -40,9 +211,13 @@ class HopfieldNetwork(object):
         Useful for retraining the network from scratch after an initial round
         of training has already been completed.
         """
-        self._weights = np.zeros((self.num_neurons, self.num_neurons), dtype=np.int_)
+        if self.low_rank:
+            self._weights = LowRankWeights(self.num_neurons)
+        else:
+            self._weights = np.zeros((self.num_neurons, self.num_neurons), dtype=np.int_)
+        self._hebbian_patterns = 0
 
-    def train(self, patterns, method="hebbian", threshold=0, inject = lambda x, y: None):
+    def train(self, patterns, method="hebbian", threshold=0, inject=None, **kwargs):
         """
         The wrapper method for the network's various training algorithms stored in
         self._trainers.
@@ -61,13 +236,18 @@ class HopfieldNetwork(object):
                         Look to self._trainers for a list of the available options.
         threshold       The threshold value for the network's activation function.
                         Defaults to 0.
+        inject          Optional callback inject(previous_weights, iteration) run after
+                        each pattern is learned.
+
+        Any further keyword arguments are passed on to the training method, e.g.
+        block_size for "storkey".
         """
         try:
-            return self._trainers[method](patterns, threshold, inject)
+            return self._trainers[method](patterns, threshold, inject, **kwargs)
         except KeyError:
             print(method + " is not a valid training method.")
 
-    def recall(self, patterns, steps=None, mode="asynchronous", inject = lambda x, y: None):
+    def recall(self, patterns, steps=None, mode="asynchronous", inject = lambda x, y: None, **kwargs):
         """
         Wrapper method for self._synchronous and self._asynchronous.
 
@@ -75,40 +255,116 @@ class HopfieldNetwork(object):
 
         patterns        The input vectors to recall. 
 
-        steps           Number of steps to compute. Defaults to None.
+        steps           Number of steps to compute. Defaults to None. In synchronous
+                        mode this is the step budget per pattern (self.max_steps when
+                        None), and recall_status / recall_steps record how each
+                        pattern finished (see converge()). In parallel mode it is
+                        the number of sweeps allowed per pattern.
+
+        Any further keyword arguments are passed on to the recall method, e.g.
+        workers and seed for "parallel".
 
         Given 'patterns', recall(patterns) classifies these patterns based on those
         which the network has already seen.
         """
         try:
-            return self._recall_modes[mode](patterns, steps, inject)
+            return self._recall_modes[mode](patterns, steps, inject, **kwargs)
         except KeyError:
             print(mode + " is not a valid recall mode.")
 
     def energy(self, state):
         """
         Returns the energy for any input to the network.
+
+        A matrix with one state per row returns the energy of each row.
         """
-        return -0.5 * np.sum(np.multiply(np.outer(state, state), self._weights))
+        state = np.asarray(state)
+        if state.ndim > 1:
+            return self.energies(state)
+        return -0.5 * np.dot(state, self._dot(state))
 
-    def _synchronous(self, patterns, steps=10):
+    def energies(self, states):
+        """
+        Returns the energies -0.5 * s.W.s of an (M, N) matrix of states.
+
+        Computed as one (M, N) product with W followed by a row-wise dot
+        product, so no N x N temporaries are allocated.
+        """
+        states = np.atleast_2d(states)
+        return -0.5 * np.einsum('ij,ij->i', self._dot(states), states)
+
+    def _dot(self, states):
+        """
+        Returns states . W for either weight representation.
+        """
+        if self.low_rank:
+            return self._weights.dot(states)
+        return np.dot(states, self._weights)
+
+    def _weight_row(self, index):
+        """
+        Returns W[index, :] for either weight representation.
+        """
+        if self.low_rank:
+            return self._weights.row(index)
+        return self._weights[index, :]
+
+    def converge(self, patterns, max_steps=None, history=8, inject=None):
+        """
+        Synchronous recall that stops each pattern as soon as its outcome is known.
+
+        Every step applies the activation function to all patterns that are still
+        running. The last `history` states of each pattern are kept in a table
+        keyed by their packed bits, so a pattern stops when its new state repeats
+        the previous one (a fixed point) or an earlier one (a limit cycle, of
+        period two for symmetric weights). Patterns still changing after max_steps
+        steps (self.max_steps when None) time out.
+
+        Returns (states, status, steps): the final states, one of "converged",
+        "cycled" or "timeout" per pattern, and the number of steps each pattern ran.
+        """
+        if max_steps is None:
+            max_steps = self.max_steps
+        states = np.array(patterns, ndmin=2)
+        status = np.full(len(states), "timeout", dtype="<U9")
+        steps = np.zeros(len(states), dtype=np.int_)
+        seen = [{np.packbits(state > 0).tobytes(): 0} for state in states]
+        order = [list(table) for table in seen]
+        active = np.arange(len(states))
+        for step in range(1, max_steps + 1):
+            if len(active) == 0:
+                break
+            states[active] = self._activation(self._dot(states[active]), states[active])
+            steps[active] = step
+            if inject is not None:
+                inject(states, step)
+            running = []
+            for k in active:
+                key = np.packbits(states[k] > 0).tobytes()
+                if key in seen[k]:
+                    status[k] = "converged" if seen[k][key] == step - 1 else "cycled"
+                    continue
+                seen[k][key] = step
+                order[k].append(key)
+                if len(order[k]) > history:
+                    del seen[k][order[k].pop(0)]
+                running.append(k)
+            active = np.array(running, dtype=np.int_)
+        if np.ndim(patterns) == 1:
+            return states[0], status[0], steps[0]
+        return states, status, steps
+
+    def _synchronous(self, patterns, steps=None, inject=None):
         """
         Updates all network neurons simultaneously during each iteration of the
         recall process.
 
         Faster than asynchronous updating, but convergence of the recall method
-        is not guaranteed.
+        is not guaranteed: patterns can fall into two-state cycles. Each pattern
+        stops at a fixed point, a detected cycle or after `steps` steps.
         """
-        if steps:
-            for i in range(steps):
-                patterns = np.dot(patterns, self._weights)
-            return self._vec_activation(patterns)
-        else:
-            while True:
-                post_recall = self._vec_activation(np.dot(patterns, self._weights))
-                if np.array_equal(patterns, post_recall):
-                    return self._vec_activation(post_recall)
-                patterns = post_recall
+        states, self.recall_status, self.recall_steps = self.converge(patterns, steps, inject=inject)
+        return states
 
     def _asynchronous(self, patterns, steps=None, inject=lambda x:None):
         """
@@ -122,8 +378,9 @@ class HopfieldNetwork(object):
         if steps:
             for i in range(steps):
                 index = random.randrange(self.num_neurons)
-                patterns[:,index] = np.dot(self._weights[index,:], np.transpose(patterns))
-            return self._vec_activation(patterns)
+                fields = np.dot(patterns, self._weight_row(index))
+                patterns[:,index] = self._activation(fields, patterns[:,index])
+            return patterns
         else:
             post_recall = patterns.copy()
             inject(post_recall, 0)
@@ -132,46 +389,143 @@ class HopfieldNetwork(object):
             while True:
                 index = random.randrange(self.num_neurons)
                 indicies.add(index)
-                post_recall[:,index] = np.dot(self._weights[index,:], np.transpose(patterns))
-                post_recall = self._vec_activation(post_recall)
+                fields = np.dot(patterns, self._weight_row(index))
+                post_recall[:,index] = self._activation(fields, patterns[:,index])
                 inject(post_recall, i)
                 if np.array_equal(patterns, post_recall) and len(indicies) == self.num_neurons:
-                    return self._vec_activation(post_recall)
+                    return post_recall
                 patterns = post_recall.copy()
                 i += 1
 
-    def _activation(self, value, threshold=0):
+    def _parallel(self, patterns, steps=None, inject=None, workers=None, seed=0):
+        """
+        Asynchronous recall with the patterns sharded across a process pool that
+        shares the weight matrix (see parallel_recall).
+
+        Every sweep updates each neuron once in random order, and a pattern stops
+        after a sweep without changes or after `steps` sweeps (self.max_steps when
+        None). The inject callback is not called, as the work happens in other
+        processes. Low-rank networks materialize their dense weights first.
+        """
+        if steps is None:
+            steps = self.max_steps
+        return parallel_recall(self.weights(), patterns, workers, seed, self.threshold, steps)
+
+    def _activation(self, values, previous=None):
         """
-        The network's activation function.
+        The network's activation function, applied elementwise.
 
-        Defaults to the sign function.
+        Defaults to the sign function around self.threshold. Values exactly at the
+        threshold keep their previous state when one is given.
         """
-        if value < threshold:
-            return -1
-        return 1
+        return sign_activation(values, self.threshold, previous)
 
-    def _train_activation(self, value, threshold=0):
-        if value == threshold:
-            return value
-        elif value < threshold:
-            return -1
-        return 1
+    def _train_activation(self, values, threshold=0):
+        return train_activation(values, threshold)
 
-    def _hebbian(self, patterns, threshold=0, inject= lambda x, y: None):
+    def _hebbian(self, patterns, threshold=0, inject=None):
         """
         Implements Hebbian learning.
+
+        The weights are W = (X^T X - P*I) / P for all P patterns learned since the
+        last reset, so training in several calls gives the same weights as one
+        call with every pattern, for dense and low-rank networks alike.
+
+        Without an inject callback all patterns are added with a single matrix
+        product; low-rank networks only store the patterns. With a callback the
+        patterns are learned one at a time and inject receives the weights from
+        before each pattern (materialized as a dense matrix for low-rank networks).
+        """
+        patterns = np.asarray(patterns)
+        if self.low_rank:
+            if inject is None:
+                self._weights.add(patterns)
+                return
+            i = 1
+            for pattern in patterns:
+                prev = self._weights.toarray()
+                self._weights.add(pattern[np.newaxis])
+                inject(prev, i)
+                i += 1
+            return
+        stored = self._hebbian_patterns
+        weights = self._weights * stored if stored else self._weights
+        if inject is None:
+            weights = weights + np.dot(patterns.T, patterns)
+            np.fill_diagonal(weights, 0)
+            self._weights = weights / (stored + len(patterns))
+        else:
+            i = 1
+            for pattern in patterns:
+                prev = self._weights.copy()
+                weights = weights + np.outer(pattern, pattern)
+                np.fill_diagonal(weights, 0)
+                self._weights = weights / (stored + i)
+                inject(prev, i)
+                i += 1
+        self._hebbian_patterns = stored + len(patterns)
+
+    def _storkey(self, patterns, threshold=0, inject=None, block_size=1):
+        """
+        Implements Storkey learning.
+
+        Patterns are learned one at a time. The local fields h = W.x of each new
+        pattern x are computed once and reused for every h_ij term, which turns
+        the rule into the matrix update
+
+            W += (x x^T - x h^T - h x^T + 2W) / N        (zero diagonal)
+
+        With block_size > 1 each block of patterns is learned with one set of
+        matrix products, using the weights from the start of the block for all
+        of its patterns. This is faster but only approximates the sequential rule.
         """
+        if self.low_rank:
+            print("Storkey learning needs a dense weight matrix; create the network with low_rank=False.")
+            return
+        patterns = np.asarray(patterns, dtype=float)
+        self._weights = self._weights.astype(float)
         i = 1
-        for pattern in patterns:
-            prev = self._weights.copy()
-            self._weights += np.outer(pattern, pattern)
-            inject(prev, i)
+        for start in range(0, len(patterns), block_size):
+            block = patterns[start:start + block_size]
+            prev = self._weights.copy() if inject is not None else None
+            fields = np.dot(block, self._weights)
+            outer = np.dot(block.T, block)
+            cross = np.dot(block.T, fields)
+            self._weights += (outer - cross - cross.T + 2 * len(block) * self._weights) / self.num_neurons
+            np.fill_diagonal(self._weights, 0)
+            if inject is not None:
+                inject(prev, i)
             i += 1
-        np.fill_diagonal(self._weights, 0)
-        self._weights = self._weights / len(patterns)
 
-    def _storkey(self, patterns):
+    def _projection(self, patterns, threshold=0, inject=None, tolerance=1e-10):
         """
-        Implements Storkey learning.
+        Implements the pseudo-inverse (projection) learning rule.
+
+        The weights are the orthogonal projection onto the span of the stored
+        patterns, W = X^+ X for the P x N pattern matrix X. Each pattern is
+        added with a rank-one (Greville) update: the part of the new pattern x
+        outside the current span, e = x - W x, gives
+
+            W += e e^T / (e^T e)
+
+        so new patterns can be stored online at O(N^2) each instead of
+        recomputing the pseudo-inverse over all patterns. Patterns already in
+        the span (e^T e <= tolerance * x^T x) leave W unchanged. The diagonal
+        is kept so that W remains a projection; train a fresh network (or call
+        reset()) before switching to this rule from another one.
         """
-        pass
+        if self.low_rank:
+            print("Projection learning needs a dense weight matrix; create the network with low_rank=False.")
+            return
+        patterns = np.asarray(patterns, dtype=float)
+        self._weights = self._weights.astype(float)
+        i = 1
+        for pattern in patterns:
+            residual = pattern - np.dot(self._weights, pattern)
+            norm = np.dot(residual, residual)
+            if norm > tolerance * np.dot(pattern, pattern):
+                prev = self._weights.copy() if inject is not None else None
+                self._weights += np.outer(residual, residual) / norm
+                if inject is not None:
+                    inject(prev, i)
+            i += 1
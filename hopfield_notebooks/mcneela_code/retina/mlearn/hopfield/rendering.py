@@ -0,0 +1,107 @@
+import os
+import time
+import numpy as np
+from matplotlib import animation
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.pyplot import pause
+
+# Connection colors indexed by displayed weight: 0 green, 1 blue, -1 red.
+connection_colors = ['green', 'blue', 'red']
+
+class ConnectionCollection(object):
+    """
+    Draws every connection of a fully connected network as a single
+    LineCollection, one segment per neuron pair (i < j).
+
+    Colors and line widths are set for all connections at once from the weight
+    matrix, instead of updating one Line2D artist per connection.
+    """
+    def __init__(self, x, y, axes, linewidth=1, highlight=4):
+        """
+        x, y        the Cartesian positions of the neurons
+        axes        the Matplotlib axes the connections are drawn on
+        linewidth   the width of an unchanged connection
+        highlight   the width of a connection whose weight just changed
+        """
+        x, y = np.asarray(x), np.asarray(y)
+        self.rows, self.columns = np.triu_indices(len(x), 1)
+        start = np.column_stack((x[self.rows], y[self.rows]))
+        end = np.column_stack((x[self.columns], y[self.columns]))
+        self.linewidth = linewidth
+        self.highlight = highlight
+        self.palette = to_rgba_array(connection_colors)
+        self.values = None
+        self.lines = LineCollection(np.stack((start, end), axis=1), linewidths=linewidth,
+                                    colors=self.palette[0])
+        axes.add_collection(self.lines)
+
+    def update(self, weights, highlight=True):
+        """
+        Colors each connection by its displayed weight (-1, 0 or 1). With
+        highlight, connections whose weight differs from the previous update
+        are drawn thicker.
+        """
+        values = np.asarray(weights)[self.rows, self.columns].astype(np.int_)
+        self.lines.set_color(self.palette[np.clip(values, -1, 1)])
+        if highlight and self.values is not None:
+            self.lines.set_linewidth(np.where(values != self.values, self.highlight, self.linewidth))
+        else:
+            self.lines.set_linewidth(self.linewidth)
+        self.values = values
+
+    def normalize(self):
+        """
+        Resets every connection to the normal line width.
+        """
+        self.lines.set_linewidth(self.linewidth)
+
+class FrameRenderer(object):
+    """
+    Decides when a figure is redrawn and where the frames go.
+
+    Frames requested less than 1 / fps seconds after the previous one are
+    skipped (fps=None draws every frame). Without an output file frames are
+    shown with pause(); with one, every drawn frame is appended to a GIF
+    (.gif) or to a video written with ffmpeg (any other extension), which
+    works with the non-interactive Agg backend.
+    """
+    def __init__(self, figure, fps=30, output=None, dpi=100):
+        self.figure = figure
+        self.interval = 1.0 / fps if fps else 0
+        self.last = None
+        self.skipped = 0
+        self.drawn = 0
+        self.writer = None
+        if output is not None:
+            if os.path.splitext(output)[1].lower() == ".gif":
+                self.writer = animation.PillowWriter(fps=fps or 30)
+            else:
+                self.writer = animation.FFMpegWriter(fps=fps or 30)
+            self.writer.setup(figure, output, dpi)
+
+    def draw(self, delay=0, force=False):
+        """
+        Draws a frame unless the previous one was drawn too recently. force
+        always draws, e.g. for the last frame of a phase. Returns whether a
+        frame was drawn.
+        """
+        now = time.perf_counter()
+        if not force and self.last is not None and now - self.last < self.interval:
+            self.skipped += 1
+            return False
+        if self.writer is not None:
+            self.writer.grab_frame()
+        else:
+            pause(delay)
+        self.last = time.perf_counter()
+        self.drawn += 1
+        return True
+
+    def close(self):
+        """
+        Finishes writing the output file, if any.
+        """
+        if self.writer is not None:
+            self.writer.finish()
+            self.writer = None
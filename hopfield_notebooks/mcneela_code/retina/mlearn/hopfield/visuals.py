@@ -1,12 +1,12 @@
 import numpy as np
 import time, warnings
 from retina.mlearn.hopfield.hopfield_network import *
+from retina.mlearn.hopfield.basins import map_basins
+from retina.mlearn.hopfield.rendering import ConnectionCollection, FrameRenderer
 from retina.core.axes import Fovea3D
 from matplotlib.pyplot import *
 from matplotlib import gridspec
 from matplotlib.widgets import Button
-from sklearn.decomposition import PCA
-from scipy.interpolate import griddata as gd
 
 neuron_radius = 1
 
@@ -26,7 +26,6 @@ class VisualNeuron(object):
         self.r = r
         self.x = r * np.cos(theta)
         self.y = r * np.sin(theta)
-        self.connections = {}
 
     def __repr__(self):
         """
@@ -41,29 +40,6 @@ class VisualNeuron(object):
         self.body = Circle((self.x, self.y), radius=neuron_radius, fill=False)
         axes.add_patch(self.body)
 
-    def draw_connection(self, neuron, connection_color, axes):
-        """
-        Draws a connection between two neurons.
-
-        neuron              the terminal neuron of the connection
-        connection_color    the color of the connection line to be drawn
-        axes                the Matplotlib axes to which the connection should be drawn
-        """
-        connection = Line2D((self.x, neuron.x), (self.y, neuron.y), color=connection_color)
-        self.connections.update({ neuron :  connection })
-        neuron.connections.update({ self : connection })
-        axes.add_line(self.connections[neuron])
-
-    def delete_connection(self, neuron):
-        """
-        Delete the connection between self and neuron. The connection will no longer
-        be drawn in the network diagram and will be cleared from memory.
-
-        neuron      the terminal neuron of the connection
-        """
-        network_lines = self.main_network.lines
-        del network_lines[network_lines.index(self.connections[neuron])]
-
 class VisualHopfield(HopfieldNetwork):
     def __init__(self, num_neurons):
         """
@@ -74,17 +50,28 @@ class VisualHopfield(HopfieldNetwork):
         self.neurons = [VisualNeuron(i * d_theta, num_neurons) for i in range(num_neurons)]
         self.cs_plot = None
 
-    def run_visualization(self, training_data, recall_data=None):
+    def run_visualization(self, training_data, recall_data=None, output=None, fps=30, dpi=100):
         """
         Runs the Hopfield Network visualization. Trains the network on training_data and
         recalls on recall_data.
+
+        output      Optional .gif or video file (e.g. .mp4, written with ffmpeg). When given,
+                    the visualization runs headless on the Agg backend and every drawn frame
+                    is written to this file instead of being shown.
+        fps         The target frame rate. Updates arriving faster than this are applied to
+                    the figure but not drawn; None draws every update.
+        dpi         The resolution of the recorded frames.
         """
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            ion()
+            if output is None:
+                ion()
+            else:
+                switch_backend("agg")
             self.training_data = training_data
             self.recall_data = recall_data
             self._setup_display()
+            self.frames = FrameRenderer(self.network_fig, fps=fps, output=output, dpi=dpi)
             self._draw_network()
             self._plot_state([-1 for i in range(self.num_neurons)])
             self._plot_weights()
@@ -97,8 +84,11 @@ class VisualHopfield(HopfieldNetwork):
             self._set_mode("Learning")
             for state in recall_data:
                 self.recall([state], inject=self._recall_inject)
+                self.frames.draw(force=True)
             print("Finished.")
             self._set_mode("Finished")
+            self.frames.draw(force=True)
+            self.frames.close()
 
     def _train_inject(self, prev_weights, iteration, delay=.01):
         """
@@ -109,22 +99,14 @@ class VisualHopfield(HopfieldNetwork):
         iteration           The current iteration count
         delay               The time delay between each iteration. Larger delays
                             slow the rate of visualization and vice versa.
+
+        Connections whose displayed weight changed since the previous update are
+        highlighted. The figure is only redrawn at the renderer's target frame rate.
         """
-        self.cmap.set_data(self._weights)
+        self.cmap.set_data(self.weights())
         self._update_iter(iteration)
-        new_weights = self._train_act(self.weights())
-        colors = ['green', 'blue', 'red']
-        for ((row, column), value) in np.ndenumerate(new_weights):
-            if self.neurons[row] is self.neurons[column]:
-                continue
-            elif new_weights[row,column] != prev_weights[row,column]:
-                connection = self.neurons[row].connections[self.neurons[column]]
-                setp(connection, linewidth='4')
-                setp(connection, color=colors[new_weights[row,column]])
-            else:
-                connection = self.neurons[row].connections[self.neurons[column]]
-                setp(connection, linewidth='1')
-        pause(delay)
+        self.connections.update(self._train_act(self.weights()))
+        self.frames.draw(delay)
 
     def _set_mode(self, mode):
         """
@@ -154,20 +136,20 @@ class VisualHopfield(HopfieldNetwork):
         state = np.array(state)
         self.state_plot.set_data(state.reshape(5, 5))
         currentenergy = self.energy(state)
-        current_state = self.pca.transform(state)
+        current_state = self.basins.project(state)
         if self.cs_plot:
             self.cs_plot.remove()
         self.cs_plot = self.energy_diagram.scatter(current_state[:,0], current_state[:,1], currentenergy,
                                                 s=80, c='b', marker='o')
         self._update_iter(iteration)
-        pause(delay)
+        self.frames.draw(delay)
 
     def _setup_display(self):
         """
         Sets up the Matplotlib figures and axes required for the visualization.
         """
         self.network_fig = figure(figsize=(20, 20))
-        self.network_fig.canvas.set_window_title("Hopfield Network Visualization")
+        self.network_fig.canvas.manager.set_window_title("Hopfield Network Visualization")
         gs = gridspec.GridSpec(2, 4)
         self.main_network = subplot(gs[:,:2])
         self.main_network.set_title("Network Diagram")
@@ -201,46 +183,29 @@ class VisualHopfield(HopfieldNetwork):
         """
         Draws the network diagram to the Matplotlib canvas.
         """
-        connections = set()
-        colors = ['green', 'blue', 'red']
-        for (index1, neuron) in enumerate(self.neurons):
+        for neuron in self.neurons:
             neuron.draw(self.main_network)
-            connections.add(neuron)
-            for (index2, neuron_two) in enumerate(self.neurons):
-                if neuron_two in connections:
-                    continue
-                else:
-                    connection_color = colors[int(self.weights()[index1, index2])]
-                    neuron.draw_connection(neuron_two, connection_color, self.main_network)
-            self.main_network.autoscale(tight=False)
+        self.connections = ConnectionCollection([neuron.x for neuron in self.neurons],
+                                                [neuron.y for neuron in self.neurons],
+                                                self.main_network)
+        self.connections.update(self._train_act(self.weights()))
+        self.main_network.autoscale(tight=False)
 
-    def _plot_energy(self, num_samples=4, path_length=20):
+    def _plot_energy(self, num_samples=1000, path_length=20):
         """
         Plots the energy function of the network.
 
-        num_samples         The number of samples to be used in the computation of the energy function.
-                            The greater the number of samples, the higher the accuracy of the resultant plot.
-        path_length         The number of steps to compute in calculating each sample's path of convergence
-                            toward the network's attractors.
+        num_samples         The number of random states used to map the network's basins of attraction.
+                            The greater the number of samples, the more accurate the basin statistics.
+        path_length         The maximum number of steps each sample may take to converge toward the
+                            network's attractors.
+
+        The basin map is cached on disk under a hash of the weight matrix (see basins.py), so
+        re-plotting an unchanged network does not recompute it.
         """
         attractors = self.training_data
-        states = [[np.random.choice([-1, 1]) for i in range(self.num_neurons)] for j in range(num_samples)]
-        self.pca = PCA(n_components=2)
-        self.pca.fit(attractors)
-        paths = [attractors]
-        for i in range(path_length):
-            states = self.recall(states, steps=1)
-            paths.append(states)
-        x = y = np.linspace(-1, 1, 100)
-        X,Y = np.meshgrid(x, y)
-        meshpts = np.array([[x, y] for x, y in zip(np.ravel(X), np.ravel(Y))])
-        mesh = self.pca.inverse_transform(meshpts)
-        grid = np.vstack((mesh, np.vstack(paths)))
-        energies = np.array([self.energy(point) for point in grid])
-        grid = self.pca.transform(grid)
-        gmin, gmax = grid.min(), grid.max()
-        xi, yi = np.mgrid[gmin:gmax:100j, gmin:gmax:100j]
-        zi = gd(grid, energies, (xi, yi), method='nearest')
+        self.basins = map_basins(self, attractors, num_samples=num_samples, max_steps=path_length)
+        xi, yi, zi = self.basins.xi, self.basins.yi, self.basins.zi
         wireframe = self.energy_diagram.add_layer("wireframe")
         mesh_plot = self.energy_diagram.add_layer("mesh_plot")
         attracts = self.energy_diagram.add_layer("attractors")
@@ -250,8 +215,8 @@ class VisualHopfield(HopfieldNetwork):
                                         colors=(0.5, 0.5, 0.5, 0.5), alpha=0.2)
         self.energy_diagram.build_layer(mesh_plot.name, plot=self.energy_diagram.plot_surface, cmap=cm.coolwarm)
         self.contour_diagram.contour(xi, yi, zi)
-        grid = self.pca.transform(attractors)
-        z = np.array([self.energy(state) for state in attractors])
+        grid = self.basins.project(attractors)
+        z = self.energies(attractors)
         attracts.add_data(grid[:,0], grid[:,1], z)
         self.energy_diagram.build_layer("attractors", plot=self.energy_diagram.scatter, s=80, c='g', marker='o')
         wireframe.hide()
@@ -273,10 +238,9 @@ class VisualHopfield(HopfieldNetwork):
 
         To be called between the training and recall steps of the visualization.
         """
-        for neuron in self.neurons:
-            for line in neuron.connections.values():
-                if line.get_linewidth() != 1:
-                    setp(line, linewidth=1)
+        self.cmap.set_data(self.weights())
+        self.connections.update(self._train_act(self.weights()), highlight=False)
+        self.frames.draw(force=True)
 
     def _plot_state(self, state):
         """